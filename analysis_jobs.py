@@ -0,0 +1,54 @@
+import os
+import pandas as pd
+
+# Analyses that can run inside a job worker process: module-level so they pickle under spawn,
+# and the heavy imports stay inside the functions like in gradio_app.
+
+
+def summarize_themes(output_df, theme_list):
+    # Check if the output DataFrame is empty
+    if output_df.empty:
+        return pd.DataFrame(columns=['Theme', 'Score'])  # Return an empty DataFrame
+
+    # Remove dialogue from the theme list
+    theme_list = [theme for theme in theme_list if theme != 'dialogue']
+    output_df = output_df[theme_list]
+
+    # Sum the scores for each theme
+    output_df = output_df.sum().reset_index()
+    output_df.columns = ['Theme', 'Score']
+    return output_df
+
+
+def draw_character_network(ner_df, store_path=None, episode_start=None, episode_end=None, layout="force", min_weight=1):
+    from character_network import CharacterNetworkGenerator
+
+    character_network_generator = CharacterNetworkGenerator()
+    cooccurrence_store = character_network_generator.get_cooccurrence_store(ner_df, store_path)
+    relationship_df = cooccurrence_store.get_relationship_df(start=episode_start or None, end=episode_end or None)
+    return character_network_generator.draw_network_graph(relationship_df, layout=layout, min_weight=min_weight or 1)
+
+
+def run_themes_job(params, progress_callback=None):
+    from theme_classifier import ThemeClassifier
+
+    theme_classifier = ThemeClassifier(params["theme_list"], result_store_path=params["result_store_path"], engine=params["theme_engine"])
+    output_df = theme_classifier.get_themes(params["subtitles_path"], params["save_path"],
+                                            checkpoint_dir=params["checkpoint_dir"],
+                                            progress_callback=progress_callback)
+    return summarize_themes(output_df, params["theme_list"]).to_dict("records")
+
+
+def run_network_job(params, progress_callback=None):
+    from character_network import NamedEntityRecognizer
+
+    ner = NamedEntityRecognizer(result_store_path=params["result_store_path"], model_name=params["ner_model_name"])
+    ner_df = ner.get_ners(params["subtitles_path"], params["ner_path"],
+                          checkpoint_dir=params["checkpoint_dir"],
+                          progress_callback=progress_callback)
+
+    # Per-episode co-occurrence matrices are kept next to the NER results
+    ner_path = params["ner_path"]
+    store_path = os.path.splitext(ner_path)[0] + "_cooccurrence.npz" if ner_path else None
+    return draw_character_network(ner_df, store_path, params["episode_start"], params["episode_end"],
+                                  params["layout"], params["min_weight"])
@@ -0,0 +1,110 @@
+"""Cold-start import time of each entry point.
+
+Every import runs in a fresh interpreter, so nothing is shared between measurements.
+The script also lists which heavy dependencies each import pulled in.
+
+    python benchmarks/import_time.py --repeat 5 --history benchmarks/import_time_history.jsonl
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = [
+    "gradio_app",
+    "utils",
+    "theme_classifier",
+    "character_network",
+    "text_classification",
+    "character_chatbot",
+    "theme_classifier.theme_classifier",
+    "character_network.named_entity_recognizer",
+    "text_classification.jutsu_classifier",
+    "character_chatbot.character_chatbot",
+]
+
+HEAVY_MODULES = ["torch", "transformers", "spacy", "nltk", "sklearn", "evaluate",
+                 "peft", "trl", "bitsandbytes", "datasets", "onnxruntime", "pyvis", "networkx"]
+
+MEASURE_CODE = """
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start_time
+heavy_modules = [name for name in {heavy_modules!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "heavy_modules": heavy_modules}}))
+"""
+
+
+def measure_import(module, env):
+    code = MEASURE_CODE.format(module=module, heavy_modules=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT_PATH, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        return {"error": error[-1] if error else f"exit code {result.returncode}"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def get_git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_PATH,
+                            capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def run_benchmark(modules, repeat=3):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT_PATH, os.getenv("PYTHONPATH")])))
+    results = []
+    for module in modules:
+        measurements = [measure_import(module, env) for _ in range(repeat)]
+        errors = [measurement["error"] for measurement in measurements if "error" in measurement]
+        if errors:
+            results.append({"module": module, "error": errors[0]})
+            continue
+        seconds = [measurement["seconds"] for measurement in measurements]
+        results.append({
+            "module": module,
+            "median_seconds": statistics.median(seconds),
+            "min_seconds": min(seconds),
+            "heavy_modules": measurements[-1]["heavy_modules"],
+        })
+    return results
+
+
+def print_results(results):
+    print(f"{'entry point':<45}{'median s':>10}{'min s':>10}  heavy modules loaded")
+    for result in results:
+        if "error" in result:
+            print(f"{result['module']:<45}{'failed':>10}{'':>10}  {result['error']}")
+            continue
+        print(f"{result['module']:<45}{result['median_seconds']:>10.3f}{result['min_seconds']:>10.3f}  "
+              f"{', '.join(result['heavy_modules']) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=ENTRY_POINTS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--history", default=None, help="JSONL file the results are appended to")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.modules, repeat=args.repeat)
+    print_results(results)
+
+    if args.history:
+        with open(args.history, "a", encoding="utf-8") as file:
+            file.write(json.dumps({
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "commit": get_git_commit(),
+                "python": sys.version.split()[0],
+                "results": results,
+            }) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,5 @@
-from .character_chatbot import CharacterChatbot
\ No newline at end of file
+from utils.lazy_import import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "CharacterChatbot": ".character_chatbot",
+})
@@ -1,75 +1,144 @@
 import torch
 import pandas as pd
-import huggingface_hub
 import re
-from datasets import Dataset
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-from peft import LoraConfig, PeftModel
+from transformers import BitsAndBytesConfig
 import gc
-from trl import SFTTrainer, SFTConfig
+import time
 import transformers
+import sys
+import pathlib
+folder_path = pathlib.Path(__file__).parent.resolve()
+sys.path.append(str(folder_path.parent))
+from utils.model_registry import model_registry
+from .chat_session import ChatSession, chat_sessions, stream_generate
+from .inference_server import get_inference_server
+from .cpu_backend import select_backend, has_cached_artifact, load_int8_model, load_gguf_model
+from utils.model_resolver import resolve_model, forget_model, login_once
+from .response_cache import get_response_cache, get_retriever
+from utils.sentence_encoder import SentenceEncoder
 
 ## Remove actions from lines
 
 def remove_actions(text):
     result = re.sub(r'\(.*?\)','',text)
     return result
+
+system_prompt = """ You are Naruto Uzumaki, a character from the anime series Naruto. Your responces should reflect his personality and speech patterns \n """
+
+def build_prompts(nt_df, previous_line=None):
+    # Each long Naruto line is paired with the line right before it (after dropna), all as column operations.
+    # previous_line carries the last line of the previous chunk when reading in chunks.
+    nt_df = nt_df.dropna()
+    lines = nt_df['line'].str.replace(r'\(.*?\)', '', regex=True)
+    number_of_words = lines.str.strip().str.count(" ") + 1
+    previous_lines = lines.shift(1)
+    if previous_line is not None and len(lines) > 0:
+        previous_lines.iloc[0] = previous_line
+
+    naruto_response_flag = (nt_df['name'] == 'Naruto') & (number_of_words > 4) & previous_lines.notna()
+    prompts = system_prompt + previous_lines[naruto_response_flag] + '\n' + lines[naruto_response_flag]
+    last_line = lines.iloc[-1] if len(lines) > 0 else previous_line
+    return prompts.tolist(), last_line
+
+def generate_prompts(data_path, chunksize=100_000):
+    # Streams the transcript so only one chunk of rows is in memory at a time
+    previous_line = None
+    for chunk in pd.read_csv(data_path, chunksize=chunksize):
+        prompts, previous_line = build_prompts(chunk, previous_line)
+        for prompt in prompts:
+            yield {'prompt': prompt}
 class CharacterChatbot:
     def __init__(self, 
                  model_path,
                  data_path="/content/NLP-Series-Analysis/data/naruto.csv",
-                 huggingface_token=None):
+                 huggingface_token=None,
+                 backend="auto",
+                 cpu_cache_dir=None,
+                 gguf_path=None,
+                 num_threads=None,
+                 response_cache=False,
+                 retrieval_top_k=0,
+                 encoder_model_name="sentence-transformers/all-MiniLM-L6-v2"):
         self.model_path = model_path
         self.data_path = data_path
         self.huggingface_token = huggingface_token
         self.base_model_path = "meta-llama/Llama-3.2-3B-Instruct"
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # bnb4 (CUDA), int8 (torch dynamic quantization on CPU) or gguf (llama.cpp on CPU)
+        self.backend = select_backend(model_path, cpu_cache_dir, gguf_path) if backend == "auto" else backend
+        self.device = "cuda" if self.backend == "bnb4" else "cpu"
+        self.cpu_cache_dir = cpu_cache_dir
+        self.gguf_path = gguf_path
+        self.num_threads = num_threads
+        self.retrieval_top_k = retrieval_top_k
+
+        # Both share one small sentence encoder; caches and line embeddings are shared across instances
+        self.response_cache = None
+        self.retriever = None
+        if response_cache or retrieval_top_k:
+            encoder = SentenceEncoder(encoder_model_name, device="cpu")
+            if response_cache:
+                self.response_cache = get_response_cache(self.model_path, encoder)
+            if retrieval_top_k:
+                self.retriever = get_retriever(self.data_path, encoder)
 
-        if self.huggingface_token is not None:
-            huggingface_hub.login(self.huggingface_token)
+        login_once(self.huggingface_token)
 
-        if huggingface_hub.repo_exists(self.model_path):
+        # A cached int8/GGUF conversion is enough on its own; otherwise look locally, then ask the Hub once
+        has_artifact = has_cached_artifact(self.backend, self.model_path, self.cpu_cache_dir, self.gguf_path)
+        self.resolved_model_path = None if has_artifact else resolve_model(self.model_path)
+
+        if has_artifact or self.resolved_model_path is not None:
             self.model = self.load_model(self.model_path)
         else:
              print(f"Model not found at {self.model_path}. Please check the model path and try again. Training our own model...")
              train_dataset = self.load_dataset()
              self.train_model(self.base_model_path, train_dataset)
+             forget_model(self.model_path)
+             self.resolved_model_path = resolve_model(self.model_path) or self.model_path
              self.model = self.load_model(self.model_path)
 
     def load_model(self, model_path):
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.float16,
-        )
-        pipeline = transformers.pipeline("text-generation",
-                                        model=model_path,
-                                        model_kwargs={"torch_dtype":torch.float16, "quantization_config":bnb_config,}
-                                        )
-        return pipeline
+        if self.backend == "int8":
+            def load():
+                model, tokenizer = load_int8_model(model_path,
+                                                   cache_dir=self.cpu_cache_dir,
+                                                   num_threads=self.num_threads,
+                                                   source_path=self.resolved_model_path)
+                return transformers.pipeline("text-generation", model=model, tokenizer=tokenizer)
+            return model_registry.get(("text-generation", model_path, "int8", "cpu"), load)
+
+        if self.backend == "gguf":
+            return model_registry.get(("text-generation", model_path, "gguf", "cpu"),
+                                      lambda: load_gguf_model(model_path,
+                                                              cache_dir=self.cpu_cache_dir,
+                                                              gguf_path=self.gguf_path,
+                                                              num_threads=self.num_threads,
+                                                              source_path=self.resolved_model_path))
+
+        def load():
+            bnb_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.float16,
+            )
+            pipeline = transformers.pipeline("text-generation",
+                                            model=self.resolved_model_path or model_path,
+                                            model_kwargs={"torch_dtype":torch.float16, "quantization_config":bnb_config,}
+                                            )
+            return pipeline
+        return model_registry.get(("text-generation", model_path, "bnb-4bit", self.device), load)
          
 
 
 
-    def load_dataset(self):
-        nt_df = pd.read_csv(self.data_path)
-        nt_df = nt_df.dropna()
-        nt_df['line'] = nt_df['line'].apply(remove_actions)
-        nt_df['number_of_words']= nt_df['line'].str.strip().str.split(" ")
-        nt_df['number_of_words']= nt_df['number_of_words'].apply(lambda x: len(x))
-        nt_df['naruto_response_flag'] = 0
-        nt_df.loc[(nt_df['name']=='Naruto')&(nt_df['number_of_words']>4), 'naruto_response_flag'] = 1
-        indexes = list(nt_df[(nt_df['naruto_response_flag']==1)& (nt_df.index > 0)].index)
-        system_prompt = """ You are Naruto Uzumaki, a character from the anime series Naruto. Your responces should reflect his personality and speech patterns \n """
-        prompts = []
+    def load_dataset(self, streaming=False, chunksize=100_000):
+        from datasets import Dataset
 
-        for ind in indexes:
-            prompt = system_prompt 
-            prompt += nt_df.iloc[ind-1]['line']
-            prompt += '\n'
-            prompt += nt_df.iloc[ind]['line']
-            prompts.append(prompt)
+        if streaming:
+            # Prompts are written chunk by chunk into an Arrow file instead of a DataFrame
+            return Dataset.from_generator(generate_prompts, gen_kwargs={'data_path': self.data_path, 'chunksize': chunksize})
 
+        prompts, _ = build_prompts(pd.read_csv(self.data_path))
         df= pd.DataFrame({'prompt':prompts})
         dataset = Dataset.from_pandas(df)
         return dataset
@@ -89,8 +158,16 @@ class CharacterChatbot:
               max_steps = 300,
               warmup_ratio = 0.3,
               lr_scheduler_type = "constant",
+              packing = False,
+              max_tokens_per_batch = None,
+              measure_throughput = False,
               ):
-        
+        # The training stack is only imported when a model actually has to be trained
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        from peft import LoraConfig, PeftModel
+        from trl import SFTTrainer, SFTConfig
+        from .packing import tokenize_prompts, build_training_features, PackedDataCollator, get_token_budget_trainer_class, ThroughputCallback
+
         bnb_config = BitsAndBytesConfig(
             load_in_4bit=True,
             bnb_4bit_quant_type="nf4",
@@ -117,6 +194,9 @@ class CharacterChatbot:
             task_type="CASUAL_LM"
         )
 
+        # Packing, token-budget batches and throughput stats all run on our own pre-tokenized features
+        pretokenized = packing or max_tokens_per_batch or measure_throughput
+
         training_arguments = SFTConfig(
         output_dir=output_dir,
         per_device_train_batch_size = per_device_train_batch_size,
@@ -131,12 +211,26 @@ class CharacterChatbot:
         warmup_ratio = warmup_ratio,
         group_by_length = True,
         lr_scheduler_type = lr_scheduler_type,
-        report_to = "none"
+        report_to = "none",
+        remove_unused_columns = not pretokenized,
+        dataloader_num_workers = 0,
         )
 
         max_seq_len = 512
 
-        trainer = SFTTrainer(
+        trainer_class = SFTTrainer
+        trainer_kwargs = {}
+        if pretokenized:
+            from datasets import Dataset
+
+            sequences = tokenize_prompts(tokenizer, dataset['prompt'], max_length=max_seq_len)
+            dataset = Dataset.from_list(build_training_features(sequences, block_size=max_seq_len, packing=packing))
+            collator = PackedDataCollator(tokenizer.pad_token_id, mask_dtype=torch.float16)
+            trainer_kwargs = {"data_collator": collator, "dataset_kwargs": {"skip_prepare_dataset": True}}
+            if max_tokens_per_batch:
+                trainer_class = get_token_budget_trainer_class(SFTTrainer, max_tokens_per_batch)
+
+        trainer = trainer_class(
             model = model,
             train_dataset=dataset,
             peft_config=peft_config,
@@ -144,9 +238,15 @@ class CharacterChatbot:
             max_seq_length=max_seq_len,
             tokenizer=tokenizer,
             args = training_arguments,
+            **trainer_kwargs,
         )
+        if pretokenized:
+            throughput_callback = ThroughputCallback(collator)
+            trainer.add_callback(throughput_callback)
 
         trainer.train()
+        if pretokenized:
+            self.training_stats = throughput_callback.stats
 
         # Save model 
         trainer.model.save_pretrained("final_ckpt")
@@ -173,7 +273,7 @@ class CharacterChatbot:
         del model, base_model
         gc.collect()
 
-    def chat(self, message, history):
+    def get_messages(self, message, history):
         messages = []
         # Add the system ptomp 
         messages.append({"role":"system","content":""""Your are Naruto from the anime "Naruto". Your responses should reflect his personality and speech patterns \n"""})
@@ -184,20 +284,114 @@ class CharacterChatbot:
         
         messages.append({"role":"user","content":message})
 
+        # Grounding lines go last, after the new user turn: history is stored without them, so the
+        # rendered turns stay identical from one message to the next and the session's KV prefix keeps matching
+        if self.retriever is not None:
+            top_lines = self.retriever.get_top_lines(message, top_k=self.retrieval_top_k)
+            if top_lines:
+                context = "\n".join(f"- {line}" for line in top_lines)
+                messages.append({"role":"system","content":f"Things you have said before:\n{context}"})
+        return messages
+
+    def get_terminators(self):
+        tokenizer = self.model.tokenizer
         terminator = [
-            self.model.tokenizer.eos_token_id,
-            self.model.tokenizer.convert_tokens_to_ids("<|eot_id|>")
+            tokenizer.eos_token_id,
+            tokenizer.convert_tokens_to_ids("<|eot_id|>")
         ]
+        return {token_id for token_id in terminator if token_id is not None and token_id != tokenizer.unk_token_id}
 
-        output = self.model(
-            messages,
-            max_length=256,
-            eos_token_id=terminator,
-            do_sample=True,
-            temperature=0.6,
-            top_p=0.9
-        )
+    def stream_with_cache(self, message, history, generate):
+        # Near-duplicate prompts are answered from the semantic cache instead of the LLM
+        if self.response_cache is None:
+            yield from generate()
+            return
 
-        output_message = output[0]['generated_text'][-1]
-        return output_message
+        cached_response = self.response_cache.lookup(message, history)
+        if cached_response is not None:
+            print(f"Response cache hit: {self.response_cache.stats()}")
+            yield cached_response
+            return
+
+        start_time = time.time()
+        output_text = ""
+        for output_text in generate():
+            yield output_text
+        if output_text:
+            self.response_cache.put(message, history, output_text, generation_seconds=time.time() - start_time)
+
+    def stream_chat(self, message, history, session_id=None, max_new_tokens=256, temperature=0.6, top_p=0.9):
+        # Yields the reply so far after every token; Gradio ChatInterface accepts this generator directly
+        return self.stream_with_cache(message, history,
+                                      lambda: self.generate_stream(message, history, session_id=session_id,
+                                                                   max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p))
+
+    def serve_chat(self, message, history, max_new_tokens=256, temperature=0.6, top_p=0.9):
+        # Same as stream_chat, but decode steps are batched with the other sessions on this model
+        return self.stream_with_cache(message, history,
+                                      lambda: self.generate_batched(message, history,
+                                                                    max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p))
+
+    def generate_stream(self, message, history, session_id=None, max_new_tokens=256, temperature=0.6, top_p=0.9):
+        if self.backend == "gguf":
+            yield from self.stream_chat_gguf(message, history, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+            return
+
+        tokenizer = self.model.tokenizer
+        input_ids = tokenizer.apply_chat_template(self.get_messages(message, history), add_generation_prompt=True)
+
+        # With a session id the KV cache of the previous turns is kept, so only the new turn is prefilled
+        session = chat_sessions.get((self.model_path, session_id)) if session_id is not None else ChatSession()
+        stats = {}
+        with session.lock:
+            generated_ids = []
+            for token_id in stream_generate(self.model.model,
+                                            session,
+                                            input_ids,
+                                            self.get_terminators(),
+                                            max_new_tokens=max_new_tokens,
+                                            temperature=temperature,
+                                            top_p=top_p,
+                                            stats=stats):
+                generated_ids.append(token_id)
+                yield tokenizer.decode(generated_ids, skip_special_tokens=True)
 
+        self.last_stats = stats
+        print(f"Chat: {stats['prefilled_tokens']} prefilled / {stats['reused_tokens']} reused tokens, "
+              f"TTFT {stats['time_to_first_token']:.2f}s, {stats['tokens_per_second']:.1f} tok/s")
+
+    def stream_chat_gguf(self, message, history, max_new_tokens=256, temperature=0.6, top_p=0.9):
+        stats = {}
+        output_text = ""
+        for text in self.model.stream_chat(self.get_messages(message, history),
+                                           max_new_tokens=max_new_tokens,
+                                           temperature=temperature,
+                                           top_p=top_p,
+                                           stats=stats):
+            output_text += text
+            yield output_text
+
+        self.last_stats = stats
+        print(f"Chat: TTFT {stats['time_to_first_token']:.2f}s, {stats['tokens_per_second']:.1f} tok/s")
+
+    def generate_batched(self, message, history, max_new_tokens=256, temperature=0.6, top_p=0.9):
+        if self.backend == "gguf":
+            yield from self.stream_chat_gguf(message, history, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+            return
+
+        tokenizer = self.model.tokenizer
+        input_ids = tokenizer.apply_chat_template(self.get_messages(message, history), add_generation_prompt=True)
+        server = get_inference_server(self.model_path, self.model.model, self.get_terminators())
+
+        generated_ids = []
+        for token_id in server.stream(input_ids, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p):
+            generated_ids.append(token_id)
+            yield tokenizer.decode(generated_ids, skip_special_tokens=True)
+
+    def chat(self, message, history):
+        output_text = ""
+        for output_text in self.stream_chat(message, history):
+            pass
+
+        output_message = {"role":"assistant","content":output_text}
+        return output_message
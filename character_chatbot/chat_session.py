@@ -0,0 +1,115 @@
+from collections import OrderedDict
+import threading
+import time
+import torch
+from transformers import DynamicCache
+
+
+def sample_next_token(logits, temperature=0.6, top_p=0.9):
+    # logits: (batch, vocab) -> (batch,) token ids, greedy when temperature is 0
+    if temperature == 0:
+        return logits.argmax(dim=-1)
+
+    probs = torch.softmax(logits.float() / temperature, dim=-1)
+    sorted_probs, sorted_ids = probs.sort(dim=-1, descending=True)
+    # Nucleus sampling: keep the smallest set of tokens whose mass reaches top_p
+    sorted_probs[(sorted_probs.cumsum(dim=-1) - sorted_probs) > top_p] = 0
+    sampled = torch.multinomial(sorted_probs, num_samples=1)
+    return sorted_ids.gather(-1, sampled).squeeze(-1)
+
+
+def get_common_prefix_length(cached_ids, input_ids):
+    length = 0
+    for cached_id, input_id in zip(cached_ids, input_ids):
+        if cached_id != input_id:
+            break
+        length += 1
+    return length
+
+
+class ChatSession():
+    def __init__(self):
+        # token_ids are exactly the tokens whose keys/values are held in cache
+        self.token_ids = []
+        self.cache = DynamicCache()
+        self.lock = threading.Lock()
+
+    def reuse_prefix(self, input_ids):
+        # At least one token is always prefilled so there are logits to sample from
+        prefix_length = min(get_common_prefix_length(self.token_ids, input_ids), len(input_ids) - 1)
+        if prefix_length == 0:
+            self.cache = DynamicCache()
+        elif prefix_length < self.cache.get_seq_length():
+            self.cache.crop(prefix_length)
+        self.token_ids = list(input_ids[:prefix_length])
+        return prefix_length
+
+
+class ChatSessionStore():
+    def __init__(self, max_sessions=16):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.sessions:
+                self.sessions[key] = ChatSession()
+            self.sessions.move_to_end(key)
+            # The KV caches live on the model device, so only the most recent sessions are kept
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            return self.sessions[key]
+
+    def drop(self, key):
+        with self.lock:
+            self.sessions.pop(key, None)
+
+
+chat_sessions = ChatSessionStore()
+
+
+@torch.no_grad()
+def stream_generate(model, session, input_ids, eos_token_ids, max_new_tokens=256, temperature=0.6, top_p=0.9, stats=None):
+    # Yields token ids one at a time; only the part of input_ids not already in the session cache is prefilled
+    device = model.device
+    start_time = time.time()
+    prefix_length = session.reuse_prefix(input_ids)
+    new_ids = input_ids[prefix_length:]
+
+    next_input = torch.tensor([new_ids], device=device)
+    generated = 0
+    first_token_time = None
+
+    while generated < max_new_tokens:
+        attention_mask = torch.ones((1, len(session.token_ids) + next_input.shape[1]), dtype=torch.long, device=device)
+        output = model(input_ids=next_input,
+                       attention_mask=attention_mask,
+                       past_key_values=session.cache,
+                       use_cache=True)
+        session.cache = output.past_key_values
+        session.token_ids.extend(next_input[0].tolist())
+
+        next_token = sample_next_token(output.logits[:, -1, :], temperature=temperature, top_p=top_p)
+        token_id = int(next_token[0])
+        generated += 1
+        if first_token_time is None:
+            first_token_time = time.time()
+        if token_id in eos_token_ids:
+            break
+        yield token_id
+        next_input = next_token[:, None]
+
+    if stats is not None:
+        end_time = time.time()
+        first_token_time = first_token_time or end_time
+        decode_seconds = end_time - first_token_time
+        stats.update({
+            "prompt_tokens": len(input_ids),
+            "reused_tokens": prefix_length,
+            "prefilled_tokens": len(new_ids),
+            "generated_tokens": generated,
+            "time_to_first_token": first_token_time - start_time,
+            "total_seconds": end_time - start_time,
+            "tokens_per_second": (generated - 1) / decode_seconds if generated > 1 and decode_seconds > 0 else 0.0,
+        })
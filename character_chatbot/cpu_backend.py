@@ -0,0 +1,182 @@
+import glob
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+from utils.onnx_backend import get_cache_dir
+
+DEFAULT_CHATBOT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nlp_series_analysis", "chatbot")
+INT8_FILE_NAME = "model.int8.pt"
+GGUF_FILE_NAME = "model.q8_0.gguf"
+
+
+def has_module(name):
+    return importlib.util.find_spec(name) is not None
+
+
+def get_chatbot_cache_dir(model_path, cache_dir=None):
+    return get_cache_dir(model_path, cache_dir or DEFAULT_CHATBOT_CACHE_DIR)
+
+
+def find_gguf_path(model_path, cache_dir=None, gguf_path=None):
+    # An explicit file, a previous conversion, or a .gguf file shipped in a local model folder
+    if gguf_path:
+        return gguf_path
+    cached_path = os.path.join(get_chatbot_cache_dir(model_path, cache_dir), GGUF_FILE_NAME)
+    if os.path.exists(cached_path):
+        return cached_path
+    if os.path.isdir(model_path):
+        local_paths = sorted(glob.glob(os.path.join(model_path, "*.gguf")))
+        if local_paths:
+            return local_paths[0]
+    return None
+
+
+def select_backend(model_path, cache_dir=None, gguf_path=None):
+    # 4-bit bitsandbytes needs CUDA; on CPU prefer llama.cpp when a GGUF file can be had, else torch int8
+    if torch.cuda.is_available() and has_module("bitsandbytes"):
+        return "bnb4"
+    if has_module("llama_cpp") and (find_gguf_path(model_path, cache_dir, gguf_path) or os.getenv("llama_cpp_convert_script")):
+        return "gguf"
+    return "int8"
+
+
+def has_cached_artifact(backend, model_path, cache_dir=None, gguf_path=None):
+    if backend == "int8":
+        return os.path.exists(os.path.join(get_chatbot_cache_dir(model_path, cache_dir), INT8_FILE_NAME))
+    if backend == "gguf":
+        return find_gguf_path(model_path, cache_dir, gguf_path) is not None
+    return False
+
+
+def load_merged_model(model_path, torch_dtype=torch.float32):
+    # The chatbot repo holds a LoRA adapter; fold it into the base weights so no PEFT layers remain
+    if not has_module("peft"):
+        return AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch_dtype)
+    from peft import AutoPeftModelForCausalLM, PeftConfig
+
+    try:
+        PeftConfig.from_pretrained(model_path)
+    except (OSError, ValueError):
+        return AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch_dtype)
+    model = AutoPeftModelForCausalLM.from_pretrained(model_path, torch_dtype=torch_dtype)
+    return model.merge_and_unload()
+
+
+def get_tokenizer(model_path):
+    try:
+        return AutoTokenizer.from_pretrained(model_path)
+    except (OSError, ValueError):
+        # Adapter-only repos may not ship a tokenizer; use the base model's
+        from peft import PeftConfig
+        return AutoTokenizer.from_pretrained(PeftConfig.from_pretrained(model_path).base_model_name_or_path)
+
+
+def quantize_int8(model):
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_int8_model(model_path, cache_dir=None, num_threads=None, source_path=None):
+    # Returns (model, tokenizer); the quantized weights are cached so the merge runs once per model.
+    # model_path names the cache entry, source_path (e.g. a local copy) is what gets converted
+    from transformers.modeling_utils import no_init_weights
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    model_cache_dir = get_chatbot_cache_dir(model_path, cache_dir)
+    int8_path = os.path.join(model_cache_dir, INT8_FILE_NAME)
+
+    if not os.path.exists(int8_path):
+        print(f"Merging and quantizing {model_path} to int8 in {model_cache_dir}")
+        start_time = time.time()
+        os.makedirs(model_cache_dir, exist_ok=True)
+        model = quantize_int8(load_merged_model(source_path or model_path).eval())
+        tokenizer = get_tokenizer(source_path or model_path)
+
+        torch.save(model.state_dict(), int8_path + ".tmp")
+        os.replace(int8_path + ".tmp", int8_path)
+        model.config.save_pretrained(model_cache_dir)
+        tokenizer.save_pretrained(model_cache_dir)
+        with open(os.path.join(model_cache_dir, "int8.json"), "w") as file:
+            json.dump({"model_path": model_path, "torch_version": torch.__version__,
+                       "seconds": time.time() - start_time}, file, indent=2)
+        return model, tokenizer
+
+    # Same module structure as at save time: empty fp32 model, quantized, then the int8 weights
+    config = AutoConfig.from_pretrained(model_cache_dir)
+    with no_init_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32)
+    model = quantize_int8(model.eval())
+    model.load_state_dict(torch.load(int8_path, weights_only=False))
+    tokenizer = AutoTokenizer.from_pretrained(model_cache_dir)
+    return model, tokenizer
+
+
+def export_gguf(model_path, model_cache_dir, convert_script, outtype="q8_0"):
+    # llama.cpp's convert_hf_to_gguf.py reads a plain Hugging Face folder, so the LoRA is merged first
+    merged_dir = os.path.join(model_cache_dir, "merged")
+    if not os.path.exists(os.path.join(merged_dir, "config.json")):
+        model = load_merged_model(model_path, torch_dtype=torch.float16)
+        model.save_pretrained(merged_dir)
+        get_tokenizer(model_path).save_pretrained(merged_dir)
+        del model
+
+    gguf_path = os.path.join(model_cache_dir, GGUF_FILE_NAME)
+    subprocess.run([sys.executable, convert_script, merged_dir, "--outfile", gguf_path + ".tmp", "--outtype", outtype], check=True)
+    os.replace(gguf_path + ".tmp", gguf_path)
+    return gguf_path
+
+
+class GGUFChatModel():
+    def __init__(self, gguf_path, num_threads=None, n_ctx=4096):
+        from llama_cpp import Llama
+
+        self.gguf_path = gguf_path
+        # llama.cpp keeps the evaluated prompt and reuses its longest common prefix on the next call
+        self.llm = Llama(model_path=gguf_path, n_ctx=n_ctx, n_threads=num_threads or os.cpu_count(), verbose=False)
+
+    def stream_chat(self, messages, max_new_tokens=256, temperature=0.6, top_p=0.9, stats=None):
+        start_time = time.time()
+        first_token_time = None
+        generated = 0
+        for chunk in self.llm.create_chat_completion(messages,
+                                                     max_tokens=max_new_tokens,
+                                                     temperature=temperature,
+                                                     top_p=top_p,
+                                                     stream=True):
+            text = chunk["choices"][0]["delta"].get("content")
+            if not text:
+                continue
+            generated += 1
+            if first_token_time is None:
+                first_token_time = time.time()
+            yield text
+
+        if stats is not None:
+            end_time = time.time()
+            first_token_time = first_token_time or end_time
+            decode_seconds = end_time - first_token_time
+            stats.update({
+                "generated_tokens": generated,
+                "time_to_first_token": first_token_time - start_time,
+                "total_seconds": end_time - start_time,
+                "tokens_per_second": (generated - 1) / decode_seconds if generated > 1 and decode_seconds > 0 else 0.0,
+            })
+
+
+def load_gguf_model(model_path, cache_dir=None, gguf_path=None, num_threads=None, n_ctx=4096, source_path=None):
+    gguf_path = find_gguf_path(model_path, cache_dir, gguf_path)
+    if gguf_path is None:
+        convert_script = os.getenv("llama_cpp_convert_script")
+        if not convert_script:
+            raise ValueError("No GGUF file found. Pass gguf_path or set llama_cpp_convert_script "
+                             "to llama.cpp's convert_hf_to_gguf.py to convert the merged model.")
+        model_cache_dir = get_chatbot_cache_dir(model_path, cache_dir)
+        os.makedirs(model_cache_dir, exist_ok=True)
+        print(f"Converting {model_path} to GGUF in {model_cache_dir}")
+        gguf_path = export_gguf(source_path or model_path, model_cache_dir, convert_script)
+    return GGUFChatModel(gguf_path, num_threads=num_threads, n_ctx=n_ctx)
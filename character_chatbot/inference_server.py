@@ -0,0 +1,283 @@
+import asyncio
+from collections import deque
+import itertools
+import threading
+import time
+import torch
+from transformers import DynamicCache
+from .chat_session import sample_next_token
+
+
+class ServerBusyError(RuntimeError):
+    pass
+
+
+class GenerationRequest():
+    def __init__(self, request_id, input_ids, max_new_tokens, temperature, top_p):
+        self.request_id = request_id
+        self.input_ids = list(input_ids)
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.tokens = asyncio.Queue()
+        # Tokens sampled on the model thread, handed to the event loop after each step
+        self.pending_tokens = []
+        # Per-layer (key, value) tensors of shape (1, heads, length, head_dim)
+        self.past_key_values = None
+        self.length = 0
+        self.next_token = None
+        self.generated = 0
+        self.submit_time = time.time()
+        self.first_token_time = None
+        self.finish_time = None
+
+    def stats(self):
+        end_time = self.finish_time or time.time()
+        first_token_time = self.first_token_time or end_time
+        decode_seconds = end_time - first_token_time
+        return {
+            "prompt_tokens": len(self.input_ids),
+            "generated_tokens": self.generated,
+            "time_to_first_token": first_token_time - self.submit_time,
+            "tokens_per_second": (self.generated - 1) / decode_seconds if self.generated > 1 and decode_seconds > 0 else 0.0,
+        }
+
+
+class ChatInferenceServer():
+    def __init__(self,
+                 model,
+                 eos_token_ids,
+                 max_batch_size=8,
+                 max_queue_size=32,
+                 max_new_tokens=256,
+                 max_total_tokens=None):
+        self.model = model
+        self.eos_token_ids = set(eos_token_ids)
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.max_new_tokens = max_new_tokens
+        self.max_total_tokens = max_total_tokens or getattr(model.config, "max_position_embeddings", None)
+
+        self.waiting = deque()
+        self.active = []
+        self.request_ids = itertools.count()
+        self.loop = None
+        self.wakeup = asyncio.Event()
+        self.thread = None
+
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.generated_tokens = 0
+        self.decode_steps = 0
+        self.decoded_tokens = 0
+        self.max_queue_depth = 0
+        self.recent_stats = deque(maxlen=100)
+
+    # Admission
+
+    def admit(self, input_ids, max_new_tokens=None, temperature=0.6, top_p=0.9):
+        max_new_tokens = min(max_new_tokens or self.max_new_tokens, self.max_new_tokens)
+        if len(self.waiting) >= self.max_queue_size:
+            self.rejected += 1
+            raise ServerBusyError(f"{len(self.waiting)} requests already waiting, try again later")
+        if self.max_total_tokens is not None and len(input_ids) + max_new_tokens > self.max_total_tokens:
+            self.rejected += 1
+            raise ValueError(f"Prompt of {len(input_ids)} tokens plus {max_new_tokens} new tokens "
+                             f"exceeds the {self.max_total_tokens} token limit")
+
+        request = GenerationRequest(next(self.request_ids), input_ids, max_new_tokens, temperature, top_p)
+        self.waiting.append(request)
+        self.max_queue_depth = max(self.max_queue_depth, len(self.waiting))
+        self.wakeup.set()
+        return request
+
+    async def generate(self, input_ids, max_new_tokens=None, temperature=0.6, top_p=0.9):
+        # Async generator of token ids; must run on the server's event loop
+        request = self.admit(input_ids, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+        while True:
+            token_id = await request.tokens.get()
+            if token_id is None:
+                return
+            if isinstance(token_id, Exception):
+                raise token_id
+            yield token_id
+
+    # Scheduling
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        while True:
+            if not self.waiting and not self.active:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+
+            # New requests join the running batch between decode steps
+            admitted = []
+            while self.waiting and len(self.active) + len(admitted) < self.max_batch_size:
+                admitted.append(self.waiting.popleft())
+
+            # The model runs off the event loop so streaming and admission stay responsive
+            try:
+                await self.loop.run_in_executor(None, self.step, admitted)
+            except Exception as error:
+                # Only the requests in this step fail; the scheduler keeps serving new ones
+                self.fail(admitted + [request for request in self.active if request not in admitted], error)
+                continue
+            self.publish()
+
+    @torch.no_grad()
+    def step(self, admitted):
+        for request in admitted:
+            self.prefill(request)
+            self.active.append(request)
+        decoding = [request for request in self.active if request.finish_time is None and request not in admitted]
+        if decoding:
+            self.decode(decoding)
+
+    def prefill(self, request):
+        input_ids = torch.tensor([request.input_ids], device=self.model.device)
+        output = self.model(input_ids=input_ids, past_key_values=DynamicCache(), use_cache=True)
+        request.past_key_values = self.to_legacy_cache(output.past_key_values)
+        request.length = len(request.input_ids)
+        self.accept_token(request, output.logits[:, -1, :])
+
+    def decode(self, requests):
+        # One step for the whole batch: caches are left-padded to the longest request and masked
+        device = self.model.device
+        max_length = max(request.length for request in requests)
+        attention_mask = torch.zeros((len(requests), max_length + 1), dtype=torch.long, device=device)
+        for index, request in enumerate(requests):
+            attention_mask[index, max_length - request.length:] = 1
+
+        batch_cache = []
+        for layer_index in range(len(requests[0].past_key_values)):
+            keys, values = [], []
+            for request in requests:
+                key, value = request.past_key_values[layer_index]
+                padding = max_length - request.length
+                keys.append(torch.nn.functional.pad(key, (0, 0, padding, 0)))
+                values.append(torch.nn.functional.pad(value, (0, 0, padding, 0)))
+            batch_cache.append((torch.cat(keys), torch.cat(values)))
+
+        input_ids = torch.tensor([[request.next_token] for request in requests], device=device)
+        position_ids = torch.tensor([[request.length] for request in requests], device=device)
+        output = self.model(input_ids=input_ids,
+                            attention_mask=attention_mask,
+                            position_ids=position_ids,
+                            past_key_values=DynamicCache.from_legacy_cache(tuple(batch_cache)),
+                            use_cache=True)
+        self.decode_steps += 1
+        self.decoded_tokens += len(requests)
+
+        new_cache = self.to_legacy_cache(output.past_key_values)
+        for index, request in enumerate(requests):
+            request.length += 1
+            request.past_key_values = [(key[index:index + 1, :, -request.length:], value[index:index + 1, :, -request.length:])
+                                       for key, value in new_cache]
+            self.accept_token(request, output.logits[index:index + 1, -1, :])
+
+    def accept_token(self, request, logits):
+        token_id = int(sample_next_token(logits, temperature=request.temperature, top_p=request.top_p)[0])
+        request.generated += 1
+        self.generated_tokens += 1
+        if request.first_token_time is None:
+            request.first_token_time = time.time()
+
+        if token_id in self.eos_token_ids:
+            request.finish_time = time.time()
+            return
+        request.next_token = token_id
+        request.pending_tokens.append(token_id)
+        if request.generated >= request.max_new_tokens:
+            request.finish_time = time.time()
+
+    def publish(self):
+        # Runs on the event loop: new tokens are streamed, finished requests leave the batch
+        for request in self.active:
+            for token_id in request.pending_tokens:
+                request.tokens.put_nowait(token_id)
+            request.pending_tokens = []
+
+        for request in [request for request in self.active if request.finish_time is not None]:
+            request.past_key_values = None
+            request.tokens.put_nowait(None)
+            self.active.remove(request)
+            self.completed += 1
+            self.recent_stats.append(request.stats())
+
+    def fail(self, requests, error):
+        print(f"Generation step failed for {len(requests)} requests: {error!r}")
+        for request in requests:
+            request.past_key_values = None
+            request.pending_tokens = []
+            request.tokens.put_nowait(error)
+            if request in self.active:
+                self.active.remove(request)
+            self.failed += 1
+
+    def to_legacy_cache(self, past_key_values):
+        if hasattr(past_key_values, "to_legacy_cache"):
+            return list(past_key_values.to_legacy_cache())
+        return list(past_key_values)
+
+    # Running next to synchronous code (Gradio handlers)
+
+    def start(self):
+        if self.thread is not None:
+            return self
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run_loop():
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(started.set)
+            self.loop.run_until_complete(self.run())
+
+        self.thread = threading.Thread(target=run_loop, name="chat-inference-server", daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stream(self, input_ids, max_new_tokens=None, temperature=0.6, top_p=0.9):
+        # Blocking iterator over token ids for callers outside the event loop
+        async def admit():
+            return self.admit(input_ids, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+
+        request = asyncio.run_coroutine_threadsafe(admit(), self.loop).result()
+        while True:
+            token_id = asyncio.run_coroutine_threadsafe(request.tokens.get(), self.loop).result()
+            if token_id is None:
+                return
+            if isinstance(token_id, Exception):
+                raise token_id
+            yield token_id
+
+    def metrics(self):
+        recent_stats = list(self.recent_stats)
+        mean = lambda key: sum(stats[key] for stats in recent_stats) / len(recent_stats) if recent_stats else 0.0
+        return {
+            "queue_depth": len(self.waiting),
+            "max_queue_depth": self.max_queue_depth,
+            "active_requests": len(self.active),
+            "completed_requests": self.completed,
+            "rejected_requests": self.rejected,
+            "failed_requests": self.failed,
+            "generated_tokens": self.generated_tokens,
+            "decode_steps": self.decode_steps,
+            "mean_batch_size": self.decoded_tokens / max(self.decode_steps, 1),
+            "mean_time_to_first_token": mean("time_to_first_token"),
+            "mean_tokens_per_second": mean("tokens_per_second"),
+        }
+
+
+inference_servers = {}
+inference_servers_lock = threading.Lock()
+
+
+def get_inference_server(key, model, eos_token_ids, **kwargs):
+    # One scheduler per loaded model, shared by every Gradio session
+    with inference_servers_lock:
+        if key not in inference_servers:
+            inference_servers[key] = ChatInferenceServer(model, eos_token_ids, **kwargs).start()
+        return inference_servers[key]
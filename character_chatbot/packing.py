@@ -0,0 +1,165 @@
+import random
+import time
+import torch
+from transformers import TrainerCallback
+
+
+def tokenize_prompts(tokenizer, prompts, max_length=512):
+    # Every example ends with EOS so packed neighbours are separated in the token stream too
+    encoded = tokenizer(list(prompts), add_special_tokens=True, truncation=True, max_length=max_length - 1, verbose=False)
+    return [input_ids + [tokenizer.eos_token_id] for input_ids in encoded['input_ids']]
+
+
+def pack_sequences(sequences, block_size=512):
+    # First-fit decreasing: longest examples first, each into the first block with room left
+    order = sorted(range(len(sequences)), key=lambda index: -len(sequences[index]))
+    blocks, block_room = [], []
+    for index in order:
+        length = len(sequences[index])
+        for block_index, room in enumerate(block_room):
+            if length <= room:
+                blocks[block_index].append(index)
+                block_room[block_index] -= length
+                break
+        else:
+            blocks.append([index])
+            block_room.append(block_size - length)
+    return blocks
+
+
+def build_training_features(sequences, block_size=512, packing=True):
+    # input_ids holds one or more examples back to back; example_lengths marks where each one ends
+    if not packing:
+        return [{'input_ids': sequence, 'example_lengths': [len(sequence)], 'length': len(sequence)} for sequence in sequences]
+
+    features = []
+    for block in pack_sequences(sequences, block_size):
+        input_ids = [token_id for index in block for token_id in sequences[index]]
+        features.append({'input_ids': input_ids,
+                         'example_lengths': [len(sequences[index]) for index in block],
+                         'length': len(input_ids)})
+    return features
+
+
+class PackedDataCollator():
+    def __init__(self, pad_token_id, mask_dtype=torch.float32, pad_to_length=None):
+        self.pad_token_id = pad_token_id
+        self.mask_dtype = mask_dtype
+        self.pad_to_length = pad_to_length
+        self.real_tokens = 0
+        self.total_tokens = 0
+
+    def __call__(self, features):
+        batch_length = max(len(feature['input_ids']) for feature in features)
+        if self.pad_to_length is not None:
+            batch_length = max(batch_length, self.pad_to_length)
+
+        input_ids = torch.full((len(features), batch_length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(features), batch_length), -100, dtype=torch.long)
+        position_ids = torch.zeros((len(features), batch_length), dtype=torch.long)
+        # Example number of every position, -1 on padding
+        segment_ids = torch.full((len(features), batch_length), -1, dtype=torch.long)
+
+        for row, feature in enumerate(features):
+            start = 0
+            for segment, length in enumerate(feature['example_lengths']):
+                end = start + length
+                tokens = torch.tensor(feature['input_ids'][start:end], dtype=torch.long)
+                input_ids[row, start:end] = tokens
+                labels[row, start:end] = tokens
+                # The first token of an example must not be predicted from the previous example
+                labels[row, start] = -100
+                position_ids[row, start:end] = torch.arange(length)
+                segment_ids[row, start:end] = segment
+                start = end
+            self.real_tokens += start
+        self.total_tokens += input_ids.numel()
+
+        # Block-diagonal causal mask in the additive 4D form the model uses as is
+        causal = torch.tril(torch.ones((batch_length, batch_length), dtype=torch.bool))
+        allowed = (segment_ids[:, :, None] == segment_ids[:, None, :]) & (segment_ids[:, :, None] >= 0) & causal
+        allowed |= torch.eye(batch_length, dtype=torch.bool)
+        attention_mask = torch.zeros(allowed.shape, dtype=self.mask_dtype)
+        attention_mask.masked_fill_(~allowed, torch.finfo(self.mask_dtype).min)
+
+        return {'input_ids': input_ids,
+                'labels': labels,
+                'position_ids': position_ids,
+                'attention_mask': attention_mask[:, None, :, :]}
+
+    def padding_ratio(self):
+        return 1 - self.real_tokens / self.total_tokens if self.total_tokens else 0.0
+
+
+class TokenBudgetBatchSampler():
+    # Batches of similar-length examples holding at most max_tokens tokens once padded
+    def __init__(self, lengths, max_tokens=2048, shuffle=True, seed=0):
+        self.lengths = list(lengths)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.batches = self.build_batches()
+
+    def build_batches(self):
+        order = sorted(range(len(self.lengths)), key=lambda index: self.lengths[index])
+        batches, batch, batch_max = [], [], 0
+        for index in order:
+            length = self.lengths[index]
+            if batch and max(batch_max, length) * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch, batch_max = [], 0
+            batch.append(index)
+            batch_max = max(batch_max, length)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        batches = list(self.batches)
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(batches)
+            self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+def get_token_budget_trainer_class(trainer_class, max_tokens):
+    class TokenBudgetTrainer(trainer_class):
+        def get_train_dataloader(self):
+            batch_sampler = TokenBudgetBatchSampler(self.train_dataset['length'], max_tokens=max_tokens, seed=self.args.seed)
+            return torch.utils.data.DataLoader(self.train_dataset,
+                                               batch_sampler=batch_sampler,
+                                               collate_fn=self.data_collator,
+                                               num_workers=self.args.dataloader_num_workers,
+                                               pin_memory=self.args.dataloader_pin_memory)
+    return TokenBudgetTrainer
+
+
+class ThroughputCallback(TrainerCallback):
+    # Reads the collator's counters, so it needs dataloader_num_workers=0
+    def __init__(self, collator):
+        self.collator = collator
+        self.start_time = None
+        self.stats = {}
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.start_time = time.time()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is not None and self.start_time is not None:
+            logs.update(self.get_stats())
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.stats = self.get_stats()
+        print(f"Training throughput: {self.stats}")
+
+    def get_stats(self):
+        seconds = time.time() - self.start_time
+        return {
+            "tokens_per_second": self.collator.real_tokens / seconds if seconds > 0 else 0.0,
+            "padded_tokens_per_second": self.collator.total_tokens / seconds if seconds > 0 else 0.0,
+            "padding_ratio": self.collator.padding_ratio(),
+        }
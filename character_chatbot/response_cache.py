@@ -0,0 +1,127 @@
+from collections import OrderedDict
+import re
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+
+def normalize_text(text):
+    text = re.sub(r"[^\w\s']", " ", str(text).lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class SemanticResponseCache():
+    def __init__(self, encoder, similarity_threshold=0.92, max_entries=1024, ttl_seconds=3600, history_turns=1):
+        self.encoder = encoder
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.history_turns = history_turns
+
+        # key -> (embedding, response, created_at, generation_seconds), oldest use first
+        self.entries = OrderedDict()
+        self.keys = []
+        self.embeddings = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get_key_text(self, message, history):
+        # The last few turns are part of the key, so "why?" after two different answers is not a repeat
+        turns = [normalize_text(text) for turn in history[-self.history_turns:] for text in turn] if self.history_turns else []
+        return " | ".join(turns + [normalize_text(message)])
+
+    def get_index(self):
+        # The stacked embedding matrix is rebuilt only after the entries change
+        if self.embeddings is None:
+            self.keys = list(self.entries)
+            self.embeddings = np.stack([self.entries[key][0] for key in self.keys]) if self.keys else None
+        return self.keys, self.embeddings
+
+    def evict(self):
+        now = time.time()
+        expired = [key for key, entry in self.entries.items() if self.ttl_seconds and now - entry[2] > self.ttl_seconds]
+        for key in expired:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.embeddings = None
+
+    def lookup(self, message, history):
+        key_text = self.get_key_text(message, history)
+        embedding = self.encoder.encode([key_text])[0]
+        with self.lock:
+            keys, embeddings = self.get_index()
+            if embeddings is not None:
+                similarities = embeddings @ embedding
+                best = int(np.argmax(similarities))
+                key = keys[best]
+                entry = self.entries[key]
+                fresh = not self.ttl_seconds or time.time() - entry[2] <= self.ttl_seconds
+                if similarities[best] >= self.similarity_threshold and fresh:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_seconds += entry[3]
+                    return entry[1]
+            self.misses += 1
+        return None
+
+    def put(self, message, history, response, generation_seconds=0.0):
+        key_text = self.get_key_text(message, history)
+        embedding = self.encoder.encode([key_text])[0]
+        with self.lock:
+            self.entries[key_text] = (embedding, response, time.time(), generation_seconds)
+            self.entries.move_to_end(key_text)
+            self.evict()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
+
+
+class CanonicalLineRetriever():
+    def __init__(self, encoder, data_path, character_name="Naruto", min_words=4):
+        from .character_chatbot import remove_actions
+
+        self.encoder = encoder
+        df = pd.read_csv(data_path).dropna()
+        lines = df.loc[df['name'] == character_name, 'line'].apply(remove_actions).str.strip()
+        self.lines = [line for line in lines.drop_duplicates() if len(line.split()) >= min_words]
+        self.embeddings = self.encoder.encode(self.lines)
+
+    def get_top_lines(self, query, top_k=3):
+        if not self.lines or top_k <= 0:
+            return []
+        similarities = self.embeddings @ self.encoder.encode([query])[0]
+        top_index = np.argsort(-similarities, kind="stable")[:top_k]
+        return [self.lines[index] for index in top_index]
+
+
+response_caches = {}
+retrievers = {}
+shared_lock = threading.Lock()
+
+
+def get_response_cache(key, encoder, **kwargs):
+    # One cache per chat model, shared by every Gradio session
+    with shared_lock:
+        if key not in response_caches:
+            response_caches[key] = SemanticResponseCache(encoder, **kwargs)
+        return response_caches[key]
+
+
+def get_retriever(data_path, encoder, character_name="Naruto"):
+    with shared_lock:
+        key = (data_path, character_name)
+        if key not in retrievers:
+            retrievers[key] = CanonicalLineRetriever(encoder, data_path, character_name=character_name)
+        return retrievers[key]
@@ -1,3 +1,8 @@
-from .character_network_generation import CharacterNetworkGenerator
-from .named_entity_recognizer import NamedEntityRecognizer
+from utils.lazy_import import lazy_exports
 
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "CharacterNetworkGenerator": ".character_network_generation",
+    "NamedEntityRecognizer": ".named_entity_recognizer",
+    "CharacterGazetteer": ".character_gazetteer",
+    "CooccurrenceStore": ".cooccurrence_store",
+})
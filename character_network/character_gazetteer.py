@@ -0,0 +1,130 @@
+from collections import Counter, deque
+import hashlib
+import json
+import pandas as pd
+
+# Transcript speakers that are roles, not characters; a speaker with any of these words is skipped
+# ("Ninja", "Leaf Ninja", "Naruto Clone", ...)
+DEFAULT_SPEAKER_STOPLIST = {
+    "All", "Boy", "Boys", "Child", "Children", "Clone", "Clones", "Crowd", "Everyone", "Girl", "Girls",
+    "Guard", "Guards", "Kid", "Kids", "Man", "Men", "Narrator", "Ninja", "Others", "People", "Student",
+    "Students", "Teacher", "Villager", "Villagers", "Voice", "Woman", "Women",
+}
+
+
+def is_character_name(name, stoplist=DEFAULT_SPEAKER_STOPLIST):
+    words = name.split()
+    return bool(words) and all(word[:1].isupper() and word.isalpha() for word in words) and not set(words) & stoplist
+
+
+class CharacterGazetteer():
+    def __init__(self, alias_table, case_sensitive=True):
+        self.case_sensitive = case_sensitive
+        self.alias_table = {alias.strip(): name.strip() for alias, name in alias_table.items() if alias.strip()}
+        self.build_automaton()
+
+    def normalize(self, text):
+        return text if self.case_sensitive else text.lower()
+
+    def build_automaton(self):
+        # Aho-Corasick: a trie over all aliases plus failure links
+        self.transitions = [{}]
+        self.outputs = [[]]
+        self.failure = [0]
+
+        for alias, name in self.alias_table.items():
+            state = 0
+            for char in self.normalize(alias):
+                if char not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.outputs.append([])
+                    self.failure.append(0)
+                    self.transitions[state][char] = len(self.transitions) - 1
+                state = self.transitions[state][char]
+            self.outputs[state].append((len(alias), name))
+
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                fallback = self.failure[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.failure[fallback]
+                self.failure[next_state] = self.transitions[fallback].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.failure[next_state]]
+
+    def is_boundary(self, text, index):
+        return index < 0 or index >= len(text) or not text[index].isalnum()
+
+    def find(self, text):
+        normalized = self.normalize(text)
+        matches = []
+        state = 0
+        for index, char in enumerate(normalized):
+            while state and char not in self.transitions[state]:
+                state = self.failure[state]
+            state = self.transitions[state].get(char, 0)
+            for length, name in self.outputs[state]:
+                start = index - length + 1
+                # Whole words only: "Naruto" must not match inside "Narutos"
+                if self.is_boundary(normalized, start - 1) and self.is_boundary(normalized, index + 1):
+                    matches.append((start, index + 1, name))
+
+        # Leftmost-longest, non-overlapping
+        matches.sort(key=lambda match: (match[0], -(match[1] - match[0])))
+        selected = []
+        last_end = -1
+        for start, end, name in matches:
+            if start >= last_end:
+                selected.append((start, end, name))
+                last_end = end
+        return selected
+
+    def get_names(self, text):
+        return {name for _, _, name in self.find(text)}
+
+    def fingerprint(self):
+        payload = json.dumps({"aliases": self.alias_table, "case_sensitive": self.case_sensitive}, sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"aliases": self.alias_table, "case_sensitive": self.case_sensitive}, file, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return cls(data["aliases"], case_sensitive=data.get("case_sensitive", True))
+
+    @classmethod
+    def from_names(cls, names, case_sensitive=True):
+        # Full names and first names both map to the first name, like the NER output
+        alias_table = {}
+        for full_name in names:
+            full_name = str(full_name).strip()
+            if not full_name:
+                continue
+            first_name = full_name.split(" ")[0].strip()
+            alias_table[full_name] = first_name
+            alias_table.setdefault(first_name, first_name)
+        return cls(alias_table, case_sensitive=case_sensitive)
+
+    @classmethod
+    def from_naruto_csv(cls, data_path, min_lines=2, exclude=None, case_sensitive=True, stoplist=DEFAULT_SPEAKER_STOPLIST):
+        df = pd.read_csv(data_path).dropna()
+        name_counts = df['name'].str.strip().value_counts()
+        names = name_counts[name_counts >= min_lines].index.tolist()
+        names = [name for name in names if name not in set(exclude or []) and is_character_name(name, stoplist)]
+        return cls.from_names(names, case_sensitive=case_sensitive)
+
+    @classmethod
+    def from_ner_results(cls, ners, min_count=3, case_sensitive=True):
+        # Seed from one transformer NER pass: the ners column (list of sets per episode)
+        name_counts = Counter()
+        for episode_ners in ners:
+            for sentence_ners in episode_ners:
+                name_counts.update(sentence_ners)
+        names = [name for name, count in name_counts.items() if count >= min_count]
+        return cls.from_names(names, case_sensitive=case_sensitive)
@@ -1,42 +1,98 @@
-import pandas as pd
+from collections import Counter, deque
 import networkx as nx
+import hashlib
+import json
+import os
 from pyvis.network import Network
+from pyvis.edge import Edge
+from .cooccurrence_store import CooccurrenceStore, pair_counts_to_relationship_df, fingerprint_ners
+from .graph_layout import spectral_layout, force_layout
+
+# Rendered network HTML, keyed by edge-list hash and drawing options
+rendered_html_cache = {}
 
 class CharacterNetworkGenerator():
     def __init__(self):
         pass
 
+    def count_cooccurrences(self, ners, windows=10, names=None):
+        # Character names are interned to integer ids; passing names in
+        # shares (and extends) one vocabulary across calls
+        names = [] if names is None else names
+        name_to_id = {name: name_id for name_id, name in enumerate(names)}
+        pair_counts = Counter()
+
+        for row in ners:
+            # Rolling window of the last sentences and a running count per entity
+            window = deque()
+            window_counts = Counter()
+
+            for sentence in row:
+                sentence_ids = []
+                for entity in sentence:
+                    if entity not in name_to_id:
+                        name_to_id[entity] = len(names)
+                        names.append(entity)
+                    sentence_ids.append(name_to_id[entity])
+
+                window.append(sentence_ids)
+                window_counts.update(sentence_ids)
+                if len(window) > windows:
+                    for entity_id in window.popleft():
+                        window_counts[entity_id] -= 1
+                        if window_counts[entity_id] == 0:
+                            del window_counts[entity_id]
+
+                for entity_id in sentence_ids:
+                    for window_id, count in window_counts.items():
+                        if entity_id != window_id:
+                            # Pairs are keyed in name order, like sorted([entity, entity_in_window])
+                            if names[entity_id] < names[window_id]:
+                                pair_counts[(entity_id, window_id)] += count
+                            else:
+                                pair_counts[(window_id, entity_id)] += count
+
+        return names, pair_counts
+
     def generate_character_network(self,df):
 
         windows=10
-        entity_relationship = []
+        names, pair_counts = self.count_cooccurrences(df['ners'], windows=windows)
+        relationship_df = pair_counts_to_relationship_df(names, pair_counts)
 
-        for row in df['ners']:
-            previous_entities_in_window = []
+        return relationship_df
 
-            for sentence in row:
-                previous_entities_in_window.append(list(sentence))
-                previous_entities_in_window = previous_entities_in_window[-windows:]
+    def generate_cooccurrence_store(self, df, windows=10):
+        # One sparse matrix per episode over a shared character vocabulary
+        names = []
+        episode_pair_counts = []
+        for row in df['ners']:
+            names, pair_counts = self.count_cooccurrences([row], windows=windows, names=names)
+            episode_pair_counts.append(pair_counts)
 
-                # Flatten 2D List into 1D List
-                previous_entities_flattened = sum(previous_entities_in_window, [])
+        cooccurrence_store = CooccurrenceStore.from_pair_counts(names,
+                                                                df['episode'].tolist(),
+                                                                episode_pair_counts,
+                                                                source_fingerprint=fingerprint_ners(df))
+        return cooccurrence_store
 
-                for entity in sentence:
-                    for entity_in_window in previous_entities_flattened:
-                        if entity != entity_in_window:
-                            entity_relationship.append(sorted([entity, entity_in_window]))
-        
-        relationship_df = pd.DataFrame({'value': entity_relationship})
-        relationship_df['source'] = relationship_df['value'].apply(lambda x: x[0])
-        relationship_df['target'] = relationship_df['value'].apply(lambda x: x[1])
-        relationship_df = relationship_df.groupby(['source', 'target']).count().reset_index()
-        relationship_df = relationship_df.sort_values('value', ascending=False)
+    def get_cooccurrence_store(self, df, store_path=None, windows=10):
+        # Reuse the persisted matrices as long as they were built from the same NER output
+        if store_path is not None and os.path.exists(store_path):
+            cooccurrence_store = CooccurrenceStore.load(store_path)
+            if cooccurrence_store.source_fingerprint == fingerprint_ners(df):
+                return cooccurrence_store
 
-        return relationship_df
+        cooccurrence_store = self.generate_cooccurrence_store(df, windows=windows)
+        if store_path is not None:
+            cooccurrence_store.save(store_path)
+        return cooccurrence_store
     
-    def draw_network_graph(self,relationship_df):
+    def prune_network(self, relationship_df, max_edges=200, min_weight=1, min_degree=0, community=None):
         relationship_df = relationship_df.sort_values('value', ascending=False)
-        relationship_df = relationship_df.head(200)
+        relationship_df = relationship_df[relationship_df['value'] >= min_weight]
+        if max_edges is not None:
+            relationship_df = relationship_df.head(max_edges)
 
         G = nx.from_pandas_edgelist(
             relationship_df, 
@@ -46,11 +102,76 @@ class CharacterNetworkGenerator():
             create_using=nx.Graph()
         )
 
+        if min_degree > 0:
+            G.remove_nodes_from([node for node, degree in dict(G.degree).items() if degree < min_degree])
+
+        # Louvain communities become node groups (colours); one can be kept on its own
+        if G.number_of_nodes() > 0:
+            communities = nx.community.louvain_communities(G, weight='value', seed=0)
+            communities = sorted(communities, key=len, reverse=True)
+            node_group = {node: group for group, nodes in enumerate(communities) for node in nodes}
+            nx.set_node_attributes(G, node_group, 'group')
+            if community is not None:
+                G = G.subgraph([node for node, group in node_group.items() if group == community]).copy()
+
+        return G
+
+    def set_layout_positions(self, G, layout):
+        nodes = list(G.nodes)
+        adjacency = nx.to_numpy_array(G, nodelist=nodes, weight='value')
+        if layout == "spectral":
+            positions = spectral_layout(adjacency)
+        else:
+            positions = force_layout(adjacency)
+
+        for node, (x, y) in zip(nodes, positions):
+            G.nodes[node]['x'] = float(x)
+            G.nodes[node]['y'] = float(y)
+            G.nodes[node]['physics'] = False
+
+    def add_graph_to_network(self, net, G):
+        # Same result as net.from_nx(G), without pyvis's per-edge duplicate
+        # scan, which is quadratic in the number of edges
+        for node, attributes in G.nodes(data=True):
+            attributes = dict(attributes)
+            attributes['size'] = int(attributes.get('size', 10))
+            net.add_node(node, **attributes)
+        for source, target, attributes in G.edges(data=True):
+            # from_nx also sets the default width of 1 next to the value
+            net.edges.append(Edge(source, target, net.directed, **attributes, width=1).options)
+
+    def get_html_cache_key(self, relationship_df, params):
+        edges = relationship_df[['source', 'target', 'value']].sort_values(['source', 'target'])
+        cache_key = hashlib.sha1(edges.to_csv(index=False).encode('utf-8'))
+        cache_key.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return cache_key.hexdigest()
+
+    def draw_network_graph(self,relationship_df,layout="physics",max_edges=200,min_weight=1,min_degree=0,community=None,cache_dir=None):
+        params = {"layout": layout, "max_edges": max_edges, "min_weight": min_weight, "min_degree": min_degree, "community": community}
+        cache_key = self.get_html_cache_key(relationship_df, params)
+        cache_path = os.path.join(cache_dir, cache_key + ".html") if cache_dir is not None else None
+
+        # Same edge list and options: reuse the rendered HTML
+        if cache_key in rendered_html_cache:
+            return rendered_html_cache[cache_key]
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as file:
+                output_html = file.read()
+            rendered_html_cache[cache_key] = output_html
+            return output_html
+
+        G = self.prune_network(relationship_df, max_edges=max_edges, min_weight=min_weight, min_degree=min_degree, community=community)
+
         net = Network(notebook=True, width="1000px", height="700px", bgcolor="#222222", font_color="white", cdn_resources="remote")
         node_degree = dict(G.degree)
 
         nx.set_node_attributes(G, node_degree, 'size')
-        net.from_nx(G)
+
+        # Server-side layout: the browser only draws, it does not simulate
+        if layout != "physics" and G.number_of_nodes() > 0:
+            self.set_layout_positions(G, layout)
+            net.toggle_physics(False)
+        self.add_graph_to_network(net, G)
 
         html = net.generate_html()
         html = html.replace("'","\"")
@@ -60,7 +181,13 @@ class CharacterNetworkGenerator():
     allow-scripts allow-same-origin allow-popups
     allow-top-navigation-by-user-activation allow-downloads" allowfullscreen=""
     allowpaymentrequest="" frameborder="0" srcdoc='{html}'></iframe>"""
+
+        if len(rendered_html_cache) >= 32:
+            rendered_html_cache.pop(next(iter(rendered_html_cache)))
+        rendered_html_cache[cache_key] = output_html
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_path, 'w', encoding='utf-8') as file:
+                file.write(output_html)
         
         return output_html
-
-
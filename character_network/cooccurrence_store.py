@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def pair_counts_to_relationship_df(names, pair_counts):
+    relationship_df = pd.DataFrame({
+        'source': [names[source_id] for source_id, _ in pair_counts],
+        'target': [names[target_id] for _, target_id in pair_counts],
+        'value': list(pair_counts.values()),
+    }, columns=['source', 'target', 'value'])
+    relationship_df = relationship_df.sort_values(['source', 'target']).reset_index(drop=True)
+    relationship_df = relationship_df.sort_values('value', ascending=False)
+    return relationship_df
+
+
+def fingerprint_ners(df):
+    ners_hash = hashlib.sha1()
+    for episode, row in zip(df['episode'], df['ners']):
+        ners_hash.update(json.dumps([int(episode), [sorted(sentence) for sentence in row]]).encode('utf-8'))
+    return ners_hash.hexdigest()
+
+
+class CooccurrenceStore():
+    def __init__(self, names, episodes, matrices, source_fingerprint=None):
+        self.names = list(names)
+        self.episodes = [int(episode) for episode in episodes]
+        self.matrices = matrices
+        self.source_fingerprint = source_fingerprint
+
+    @classmethod
+    def from_pair_counts(cls, names, episodes, episode_pair_counts, source_fingerprint=None):
+        # Matrices are upper-triangular in name order: (source, target) with source < target
+        size = len(names)
+        matrices = []
+        for pair_counts in episode_pair_counts:
+            rows = np.array([source_id for source_id, _ in pair_counts], dtype=np.int32)
+            cols = np.array([target_id for _, target_id in pair_counts], dtype=np.int32)
+            data = np.array(list(pair_counts.values()), dtype=np.int64)
+            matrices.append(sparse.csr_matrix((data, (rows, cols)), shape=(size, size)))
+        return cls(names, episodes, matrices, source_fingerprint=source_fingerprint)
+
+    def save(self, path):
+        # All episodes go into one archive as stacked COO triplets
+        episode_index, rows, cols, data = [], [], [], []
+        for index, matrix in enumerate(self.matrices):
+            coo = matrix.tocoo()
+            episode_index.append(np.full(coo.nnz, index, dtype=np.int32))
+            rows.append(coo.row.astype(np.int32))
+            cols.append(coo.col.astype(np.int32))
+            data.append(coo.data.astype(np.int64))
+
+        tmp_path = path + '.tmp.npz'
+        np.savez_compressed(
+            tmp_path,
+            names=np.array(json.dumps(self.names)),
+            episodes=np.array(self.episodes, dtype=np.int64),
+            source_fingerprint=np.array(self.source_fingerprint or ''),
+            episode_index=np.concatenate(episode_index) if episode_index else np.zeros(0, dtype=np.int32),
+            rows=np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32),
+            cols=np.concatenate(cols) if cols else np.zeros(0, dtype=np.int32),
+            data=np.concatenate(data) if data else np.zeros(0, dtype=np.int64),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as archive:
+            names = json.loads(str(archive['names']))
+            episodes = archive['episodes'].tolist()
+            source_fingerprint = str(archive['source_fingerprint']) or None
+            episode_index = archive['episode_index']
+            rows, cols, data = archive['rows'], archive['cols'], archive['data']
+
+        size = len(names)
+        order = np.argsort(episode_index, kind='stable')
+        boundaries = np.searchsorted(episode_index[order], np.arange(len(episodes) + 1))
+        matrices = []
+        for index in range(len(episodes)):
+            selected = order[boundaries[index]:boundaries[index + 1]]
+            matrices.append(sparse.csr_matrix((data[selected], (rows[selected], cols[selected])), shape=(size, size)))
+        return cls(names, episodes, matrices, source_fingerprint=source_fingerprint)
+
+    def get_matrix(self, start=None, end=None, episodes=None):
+        # Inclusive episode range, or an explicit list of episodes
+        if episodes is not None:
+            selected_episodes = set(episodes)
+        else:
+            selected_episodes = {episode for episode in self.episodes
+                                 if (start is None or episode >= start) and (end is None or episode <= end)}
+
+        size = len(self.names)
+        matrix = sparse.csr_matrix((size, size), dtype=np.int64)
+        for episode, episode_matrix in zip(self.episodes, self.matrices):
+            if episode in selected_episodes:
+                matrix = matrix + episode_matrix
+        return matrix
+
+    def get_relationship_df(self, start=None, end=None, episodes=None):
+        matrix = self.get_matrix(start=start, end=end, episodes=episodes).tocoo()
+        pair_counts = {(source_id, target_id): value for source_id, target_id, value in zip(matrix.row, matrix.col, matrix.data) if value}
+        return pair_counts_to_relationship_df(self.names, pair_counts)
+
+    def iter_rolling(self, window=10, step=1):
+        # Network evolution: a running sum over consecutive episodes
+        order = np.argsort(self.episodes, kind='stable')
+        episodes = [self.episodes[index] for index in order]
+        matrices = [self.matrices[index] for index in order]
+        if not matrices:
+            return
+
+        window = min(window, len(matrices))
+        matrix = sum(matrices[1:window], matrices[0])
+        for start in range(0, len(matrices) - window + 1):
+            if start > 0:
+                matrix = matrix - matrices[start - 1] + matrices[start + window - 1]
+            if start % step == 0:
+                yield episodes[start], episodes[start + window - 1], matrix
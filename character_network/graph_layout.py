@@ -0,0 +1,52 @@
+import numpy as np
+
+
+def normalize_positions(positions, scale=500):
+    positions = positions - positions.mean(axis=0)
+    extent = np.abs(positions).max()
+    if extent > 0:
+        positions = positions / extent
+    return positions * scale
+
+
+def spectral_layout(adjacency, scale=500):
+    node_count = adjacency.shape[0]
+    if node_count <= 2:
+        return normalize_positions(np.random.default_rng(0).random((node_count, 2)), scale)
+
+    # Second and third eigenvectors of the normalized Laplacian
+    degree = adjacency.sum(axis=1)
+    inverse_sqrt_degree = np.where(degree > 0, 1 / np.sqrt(np.maximum(degree, 1e-12)), 0)
+    laplacian = np.eye(node_count) - inverse_sqrt_degree[:, None] * adjacency * inverse_sqrt_degree[None, :]
+    _, eigenvectors = np.linalg.eigh(laplacian)
+    positions = eigenvectors[:, 1:3] * inverse_sqrt_degree[:, None]
+    return normalize_positions(positions, scale)
+
+
+def force_layout(adjacency, iterations=150, seed=0, scale=500):
+    # Fruchterman-Reingold with all pairwise forces computed as NumPy arrays
+    node_count = adjacency.shape[0]
+    if node_count == 0:
+        return np.zeros((0, 2))
+
+    weights = adjacency / adjacency.max() if adjacency.max() > 0 else adjacency
+    positions = spectral_layout(adjacency, scale=1) if node_count > 2 else np.random.default_rng(seed).random((node_count, 2))
+    positions = positions + np.random.default_rng(seed).normal(scale=0.01, size=positions.shape)
+    optimal_distance = np.sqrt(1.0 / node_count)
+    temperature = 0.1
+
+    for _ in range(iterations):
+        delta = positions[:, None, :] - positions[None, :, :]
+        distance = np.linalg.norm(delta, axis=-1)
+        np.fill_diagonal(distance, 1)
+        distance = np.maximum(distance, 1e-3)
+
+        repulsion = optimal_distance ** 2 / distance
+        attraction = weights * distance ** 2 / optimal_distance
+        displacement = np.einsum('ijk,ij->ik', delta / distance[..., None], repulsion - attraction)
+
+        length = np.maximum(np.linalg.norm(displacement, axis=-1), 1e-9)
+        positions = positions + displacement / length[:, None] * np.minimum(length, temperature)[:, None]
+        temperature *= 0.97
+
+    return normalize_positions(positions, scale)
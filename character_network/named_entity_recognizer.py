@@ -1,53 +1,176 @@
 import spacy
-from nltk.tokenize import sent_tokenize
 import pandas as pd
 import os
 import sys
 import pathlib 
 from ast import literal_eval
-from utils.data_loader import load_subtitles_dataset
 folder_path = pathlib.Path(__file__).parent.resolve()
 sys.path.append(os.path.join(folder_path,'../'))
-from utils import load_subtitles_dataset
+from utils import load_cached_subtitles_dataset, ResultStore
+from utils.model_registry import model_registry
+from utils.pipeline_runner import PipelineRunner, PipelineStage
+from utils.nltk_data import sent_tokenize
+from .character_gazetteer import CharacterGazetteer
+
+
+UNUSED_PIPES = ["parser", "lemmatizer", "tagger", "attribute_ruler", "morphologizer", "senter"]
 
 
 class NamedEntityRecognizer:
-    def __init__(self):
-        self.nlp_model = self.load_model()
+    def __init__(self,
+                 result_store_path=None,
+                 model_name="en_core_web_trf",
+                 batch_size=256,
+                 n_process=1,
+                 gazetteer=None,
+                 engine="spacy"):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.engine = engine
+        if isinstance(gazetteer, dict):
+            gazetteer = CharacterGazetteer(gazetteer)
+        self.gazetteer = gazetteer
+        self.result_store = ResultStore(result_store_path) if result_store_path is not None else None
+
+        # spacy: every sentence goes through the model, gazetteer hits are added to its names
+        # hybrid: sentences with a gazetteer hit skip the model, faster but other names in them are lost
+        if self.engine not in ("spacy", "hybrid", "gazetteer"):
+            raise ValueError(f"Unknown NER engine '{self.engine}'. Use 'spacy', 'hybrid' or 'gazetteer'.")
+        if self.engine in ("hybrid", "gazetteer") and self.gazetteer is None:
+            raise ValueError(f"The {self.engine} engine needs a gazetteer (alias table or CharacterGazetteer).")
+
+        # The gazetteer engine never touches spaCy
+        self.nlp_model = self.load_model() if self.engine != "gazetteer" else None
         pass
     def load_model(self):
-        nlp = spacy.load("en_core_web_trf")
-        return nlp
-    def get_ners_inference(self,script):
-        script_senteces = sent_tokenize(script)
+        def load():
+            nlp = spacy.load(self.model_name)
+            # Only the NER component (and the embedding layer it listens to) is needed
+            for pipe_name in UNUSED_PIPES:
+                if pipe_name in nlp.pipe_names:
+                    nlp.disable_pipe(pipe_name)
+            return nlp
+        return model_registry.get((self.model_name, "spacy", "cpu"), load)
+    def get_stage_params(self):
+        params = {"entity_label": "PERSON"}
+        if self.gazetteer is not None:
+            params["gazetteer"] = self.gazetteer.fingerprint()
+            params["engine"] = self.engine
+        return params
+    def get_result_model_name(self):
+        return "gazetteer" if self.engine == "gazetteer" else self.model_name
+    def get_person_names(self, doc):
+        ners = set()
+        for entity in doc.ents:
+            if entity.label_ =="PERSON":
+                full_name = entity.text
+                first_name = full_name.split(" ")[0]
+                first_name = first_name.strip()
+                ners.add(first_name)
+        return ners
+    def get_ners_inference(self,script,script_senteces=None):
+        if script_senteces is None:
+            script_senteces = sent_tokenize(script)
+        if self.engine == "gazetteer":
+            return [self.gazetteer.get_names(sentence) for sentence in script_senteces]
         ner_dict = []
         for sentence in script_senteces:
+            gazetteer_names = self.gazetteer.get_names(sentence) if self.gazetteer is not None else set()
+            if self.engine == "hybrid" and gazetteer_names:
+                ner_dict.append(gazetteer_names)
+                continue
             doc = self.nlp_model(sentence)
-            ners = set()
-            for entity in doc.ents:
-                if entity.label_ =="PERSON":
-                    full_name = entity.text
-                    first_name = full_name.split(" ")[0]
-                    first_name = first_name.strip()
-                    ners.add(first_name)
+            ners = self.get_person_names(doc) | gazetteer_names
             ner_dict.append(ners)
         return ner_dict
-    def get_ners(self, dataset_path, save_path=None):
+    def iter_ners_batched(self, episodes_sentences):
+        # Flatten all sentences of all episodes into one nlp.pipe stream
+        episode_ners = [[None] * len(sentences) for sentences in episodes_sentences]
+        remaining = [len(sentences) for sentences in episodes_sentences]
+        model_sentences = []
+        model_positions = []
+        next_episode = 0
+
+        for episode_index, sentences in enumerate(episodes_sentences):
+            for sentence_index, sentence in enumerate(sentences):
+                gazetteer_names = self.gazetteer.get_names(sentence) if self.gazetteer is not None else set()
+                episode_ners[episode_index][sentence_index] = gazetteer_names
+                if self.engine == "gazetteer" or (self.engine == "hybrid" and gazetteer_names):
+                    # Fast path: known cast members are resolved without the model
+                    remaining[episode_index] -= 1
+                else:
+                    model_sentences.append(sentence)
+                    model_positions.append((episode_index, sentence_index))
+
+        # Episodes are yielded, in order, as soon as their last sentence is done
+        def flush():
+            nonlocal next_episode
+            while next_episode < len(episodes_sentences) and remaining[next_episode] == 0:
+                yield next_episode, episode_ners[next_episode]
+                next_episode += 1
+
+        yield from flush()
+        if not model_sentences:
+            return
+        docs = self.nlp_model.pipe(model_sentences, batch_size=self.batch_size, n_process=self.n_process)
+        for (episode_index, sentence_index), doc in zip(model_positions, docs):
+            episode_ners[episode_index][sentence_index] = episode_ners[episode_index][sentence_index] | self.get_person_names(doc)
+            remaining[episode_index] -= 1
+            yield from flush()
+    def get_ners_batched(self, episodes_sentences):
+        return [ners for _, ners in self.iter_ners_batched(episodes_sentences)]
+    def get_ners_incremental(self, df):
+        params = self.get_stage_params()
+        stored_ners = self.result_store.get_episode_results("ner", self.get_result_model_name(), params, df['file_hash'].tolist())
+
+        # Only episodes without stored results go through the model
+        missing_df = df[~df['file_hash'].isin(stored_ners)]
+        if len(missing_df) > 0:
+            print(f"Running NER on {len(missing_df)} new or changed episodes")
+        new_ners = {}
+        missing_hashes = missing_df['file_hash'].tolist()
+        for episode_index, ners in self.iter_ners_batched(missing_df['sentences'].tolist()):
+            episode_hash = missing_hashes[episode_index]
+            new_ners[episode_hash] = [sorted(sentence_ners) for sentence_ners in ners]
+            self.result_store.put_episode_results("ner", self.get_result_model_name(), params, {episode_hash: new_ners[episode_hash]})
+        stored_ners.update(new_ners)
+
+        return [[set(sentence_ners) for sentence_ners in stored_ners[episode_hash]] for episode_hash in df['file_hash']]
+    def get_ners_df(self, df):
+        if self.result_store is not None:
+            return self.get_ners_incremental(df)
+        return self.get_ners_batched(df['sentences'].tolist())
+    def get_pipeline_stage(self):
+        # Checkpoints are JSON, so the per-sentence name sets are stored as sorted lists
+        def run_chunk(df):
+            return [[sorted(sentence_ners) for sentence_ners in ners] for ners in self.get_ners_df(df)]
+        params = dict(self.get_stage_params(), model_name=self.get_result_model_name())
+        return PipelineStage("ners", run_chunk, params)
+    def decode_stage_results(self, results):
+        return [[set(sentence_ners) for sentence_ners in ners] for ners in results]
+    def get_ners(self, dataset_path, save_path=None, checkpoint_dir=None, progress_callback=None):
         print(f"Loading dataset from: {dataset_path}")  # Print the dataset path
-        if save_path is not None and os.path.exists(save_path):
+        if self.result_store is None and save_path is not None and os.path.exists(save_path):
             print(f"Loading NER results from: {save_path}")  # Print the NER results path
             df = pd.read_csv(save_path)
             df['ners'] = df['ners'].apply(lambda x: literal_eval(x) if isinstance(x, str) else x)
             return df
 
         # Load Dataset
-        df = load_subtitles_dataset(dataset_path)
+        df = load_cached_subtitles_dataset(dataset_path)
         
         print(f"Dataset loaded with {len(df)} records.")  # Print the number of records loaded
        
 
         # Run Inference
-        df['ners'] = df['script'].apply(self.get_ners_inference)
+        if checkpoint_dir is not None:
+            runner = PipelineRunner(checkpoint_dir)
+            ners = self.decode_stage_results(runner.run(df, [self.get_pipeline_stage()], progress_callback)["ners"])
+        else:
+            ners = self.get_ners_df(df)
+        df = df[['episode', 'script']].copy()
+        df['ners'] = ners
 
         if save_path is not None:
             df.to_csv(save_path, index=False)
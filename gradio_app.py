@@ -1,57 +1,163 @@
 import gradio as gr
-from theme_classifier import ThemeClassifier
-from utils.data_loader import load_subtitles_dataset
 import pandas as pd
-import os
-from character_network import CharacterNetworkGenerator, NamedEntityRecognizer
-from text_classification import JutsuClassifier
 from dotenv import load_dotenv
 import os
-from character_chatbot import CharacterChatbot
+from utils.model_registry import model_registry
+from analysis_jobs import summarize_themes, draw_character_network, run_themes_job, run_network_job
 load_dotenv()
 
-def get_themes(theme_list_str, subtitles_path, save_path):
+result_store_path = os.getenv("result_store_path", "result_store.sqlite")
+ner_model_name = os.getenv("ner_model", "en_core_web_trf")
+chatbot_model_path = "Koutilya/Naruto-Chatbot-Llama-3.2-3B-Instruct"
+chat_batching = os.getenv("chat_batching", "0") == "1"
+chat_response_cache = os.getenv("chat_response_cache", "0") == "1"
+chat_retrieval_top_k = int(os.getenv("chat_retrieval_top_k", "0"))
+chat_data_path = os.getenv("chat_data_path", "data/naruto.csv")
+pipeline_checkpoint_dir = os.getenv("pipeline_checkpoint_dir", "pipeline_checkpoints")
+job_workers = int(os.getenv("job_workers", "2"))
+job_queue = None
+
+# Model code (torch, transformers, spacy, ...) is imported inside the handlers so the UI starts
+# without it; the first click pays for the import once, later clicks reuse it.
+
+def warm_up_models(model_names):
+    from theme_classifier import ThemeClassifier
+    from character_network import NamedEntityRecognizer
+    from character_chatbot import CharacterChatbot
+
+    # Models are cached in the process-wide registry, so the first click does not pay for loading
+    for model_name in model_names:
+        model_name = model_name.strip()
+        print(f"Warming up {model_name}")
+        if model_name == "themes":
+            ThemeClassifier(['dialogue'])
+        elif model_name == "ner":
+            NamedEntityRecognizer(model_name=ner_model_name)
+        elif model_name == "chatbot":
+            CharacterChatbot(chatbot_model_path, huggingface_token=os.getenv("huggingface_token"))
+        elif model_name:
+            print(f"Unknown model to warm up: {model_name}")
+    print(model_registry.stats())
+
+def get_progress_callback(progress):
+    # Concurrent stages share one progress bar: the mean of their fractions, with each stage's ETA
+    stage_progress = {}
+
+    def progress_callback(stage_name, done_chunks, total_chunks, eta_seconds):
+        stage_progress[stage_name] = (done_chunks / total_chunks, eta_seconds)
+        fraction = sum(done for done, _ in stage_progress.values()) / len(stage_progress)
+        desc = " | ".join(
+            f"{name} {done:.0%}" + (f" (ETA {eta:.0f}s)" if eta else "")
+            for name, (done, eta) in stage_progress.items()
+        )
+        progress(fraction, desc=desc)
+    return progress_callback
+
+def get_theme_params(theme_list_str, subtitles_path, save_path, theme_engine="nli"):
+    return {"theme_list": theme_list_str.split(','), "subtitles_path": subtitles_path, "save_path": save_path,
+            "theme_engine": theme_engine, "result_store_path": result_store_path, "checkpoint_dir": pipeline_checkpoint_dir}
+
+def get_network_params(subtitles_path, ner_path, episode_start=None, episode_end=None, layout="force", min_weight=1):
+    return {"subtitles_path": subtitles_path, "ner_path": ner_path, "episode_start": episode_start, "episode_end": episode_end,
+            "layout": layout, "min_weight": min_weight, "ner_model_name": ner_model_name,
+            "result_store_path": result_store_path, "checkpoint_dir": pipeline_checkpoint_dir}
+
+def get_themes(theme_list_str, subtitles_path, save_path, theme_engine="nli", progress=gr.Progress()):
     # Removed print statements for terminal output
     try:
-        # Split the theme list and create the classifier
         print(f"Subtitles path: {subtitles_path}")  # Print the subtitles path
         print(f"NER save path: {save_path}")
-        theme_list = theme_list_str.split(',')
-        theme_classifier = ThemeClassifier(theme_list)
-        output_df = theme_classifier.get_themes(subtitles_path, save_path)
-        # Check if the output DataFrame is empty
-        if output_df.empty:
-            return pd.DataFrame(columns=['Theme', 'Score'])  # Return an empty DataFrame
-
-        # Remove dialogue from the theme list
-        theme_list = [theme for theme in theme_list if theme != 'dialogue']
-        output_df = output_df[theme_list]
-        
-        # Sum the scores for each theme
-        output_df = output_df.sum().reset_index()
-        output_df.columns = ['Theme', 'Score']
-        
-        # Removed terminal output
-
-        return output_df  # Return the DataFrame to be displayed
+        # Finished chunks are checkpointed, so a crashed run picks up where it stopped
+        params = get_theme_params(theme_list_str, subtitles_path, save_path, theme_engine)
+        records = run_themes_job(params, get_progress_callback(progress))
+        return pd.DataFrame(records, columns=['Theme', 'Score'])  # Return the DataFrame to be displayed
     except Exception as e:
         return pd.DataFrame(columns=['Theme', 'Score'])  # Return an empty DataFrame on error
     
-def get_character_network(subtitles_path,ner_path):
-    ner = NamedEntityRecognizer()
+def get_character_network(subtitles_path,ner_path,episode_start=None,episode_end=None,layout="force",min_weight=1,progress=gr.Progress()):
     print("Function Called")
-    ner_df = ner.get_ners(subtitles_path,ner_path)
-    print("NERs obtained")
-
-    character_network_generator = CharacterNetworkGenerator()
-    relationship_df = character_network_generator.generate_character_network(ner_df)
-    html = character_network_generator.draw_network_graph(relationship_df)
-
+    params = get_network_params(subtitles_path, ner_path, episode_start, episode_end, layout, min_weight)
+    html = run_network_job(params, get_progress_callback(progress))
     print("Done")  # Debugging step to check the generated HTML
 
     return html
 
+def get_job_queue():
+    # Created on first use: the worker processes are spawned only when a job is submitted
+    global job_queue
+    if job_queue is None:
+        from utils.job_queue import JobQueue
+        job_queue = JobQueue(result_store_path, max_workers=job_workers)
+    return job_queue
+
+def format_job_status(job):
+    if job is None:
+        return "Unknown job id"
+    status = f"{job['job_id']}: {job['status']}"
+    if job.get('elapsed_seconds') is not None:
+        status += f" for {job['elapsed_seconds']:.0f}s"
+    for stage_name, (done_chunks, total_chunks, eta_seconds) in job['progress'].items():
+        status += f" | {stage_name} {done_chunks}/{total_chunks}" + (f" (ETA {eta_seconds:.0f}s)" if eta_seconds else "")
+    if job['error']:
+        status += f" | {job['error']}"
+    return status
+
+def submit_themes_job(theme_list_str, subtitles_path, save_path, theme_engine="nli"):
+    params = get_theme_params(theme_list_str, subtitles_path, save_path, theme_engine)
+    return get_job_queue().submit("themes", run_themes_job, params)
+
+def submit_network_job(subtitles_path,ner_path,episode_start=None,episode_end=None,layout="force",min_weight=1):
+    params = get_network_params(subtitles_path, ner_path, episode_start, episode_end, layout, min_weight)
+    return get_job_queue().submit("network", run_network_job, params)
+
+def poll_job(job_id, shown_job_id, get_output):
+    # The output is sent once per finished job, not on every timer tick
+    if not job_id:
+        return "", gr.update(), shown_job_id
+    job_id = job_id.strip()
+    job = get_job_queue().status(job_id)
+    if job is None or job['status'] != "done" or job_id == shown_job_id:
+        return format_job_status(job), gr.update(), shown_job_id
+    return format_job_status(job), get_output(job['result']), job_id
+
+def poll_themes_job(job_id, shown_job_id=None):
+    return poll_job(job_id, shown_job_id, lambda records: pd.DataFrame(records, columns=['Theme', 'Score']))
+
+def poll_network_job(job_id, shown_job_id=None):
+    return poll_job(job_id, shown_job_id, lambda html: html)
+
+def cancel_job(job_id):
+    if not job_id:
+        return ""
+    get_job_queue().cancel(job_id.strip())
+    return format_job_status(get_job_queue().status(job_id.strip()))
+
+def run_full_analysis(theme_list_str, subtitles_path, theme_engine="nli", layout="force", min_weight=1, progress=gr.Progress()):
+    from theme_classifier import ThemeClassifier
+    from character_network import NamedEntityRecognizer
+    from utils import load_cached_subtitles_dataset
+    from utils.pipeline_runner import PipelineRunner
+
+    # Subtitles are parsed once; the theme and NER stages then run side by side on the same episodes
+    theme_list = theme_list_str.split(',')
+    theme_classifier = ThemeClassifier(theme_list, result_store_path=result_store_path, engine=theme_engine)
+    ner = NamedEntityRecognizer(result_store_path=result_store_path, model_name=ner_model_name)
+    df = load_cached_subtitles_dataset(subtitles_path)
+
+    runner = PipelineRunner(pipeline_checkpoint_dir)
+    results = runner.run(df, [theme_classifier.get_pipeline_stage(df), ner.get_pipeline_stage()],
+                         progress_callback=get_progress_callback(progress))
+
+    themes_df = pd.DataFrame(results["themes"])
+    ner_df = df[['episode', 'script']].copy()
+    ner_df['ners'] = ner.decode_stage_results(results["ners"])
+
+    progress(1.0, desc="network")
+    return summarize_themes(themes_df, theme_list), draw_character_network(ner_df, layout=layout, min_weight=min_weight)
+
 def classify_jutsu(text_classification_model,data_path,text_to_classify):
+    from text_classification import JutsuClassifier
+
     jutsu_classifier = JutsuClassifier(model_path = text_classification_model,
                                        data_path = data_path,
                                        huggingface_token = os.getenv("huggingface_token") )
@@ -59,14 +165,29 @@ def classify_jutsu(text_classification_model,data_path,text_to_classify):
     output = output[0]
     return output
 
-def chatbot_character(message,history):
-    character_chatbot = CharacterChatbot("Koutilya/Naruto-Chatbot-Llama-3.2-3B-Instruct",
-                                         huggingface_token = os.getenv("huggingface_token"))
-    output = character_chatbot.chat(message,history)
-    output = output['content'].strip()
-    return output
+def chatbot_character(message,history,request: gr.Request = None):
+    from character_chatbot import CharacterChatbot
+
+    character_chatbot = CharacterChatbot(chatbot_model_path,
+                                         data_path = chat_data_path,
+                                         huggingface_token = os.getenv("huggingface_token"),
+                                         response_cache = chat_response_cache,
+                                         retrieval_top_k = chat_retrieval_top_k)
+    if chat_batching:
+        # Concurrent sessions share batched decode steps on one scheduler
+        outputs = character_chatbot.serve_chat(message,history)
+    else:
+        # Each browser session keeps its own KV cache between messages
+        session_id = request.session_hash if request is not None else None
+        outputs = character_chatbot.stream_chat(message,history,session_id=session_id)
+    for output in outputs:
+        yield output.strip()
 
 def main():
+    # e.g. warm_up_models=themes,ner,chatbot
+    warm_up = os.getenv("warm_up_models")
+    if warm_up:
+        warm_up_models(warm_up.split(','))
 
     with gr.Blocks() as iface:
         with gr.Row():
@@ -80,8 +201,20 @@ def main():
                         theme_list_str = gr.Textbox(label="Theme List", placeholder="Enter themes separated by commas")
                         subtitles_path = gr.Textbox(label="Subtitles Path / Script Path", placeholder="Enter the path to subtitles")
                         save_path = gr.Textbox(label="Save Path", placeholder="Enter the path to save results")
+                        theme_engine = gr.Dropdown(label="Theme Engine", choices=["nli", "embedding"], value="nli")
                         theme_classifier_button = gr.Button("Classify Themes")
-                        theme_classifier_button.click(get_themes, inputs=[theme_list_str, subtitles_path, save_path], outputs=[output_table])
+                        theme_classifier_button.click(get_themes, inputs=[theme_list_str, subtitles_path, save_path, theme_engine], outputs=[output_table])
+                        # Background job: the result is kept in the result store under the job id
+                        with gr.Row():
+                            theme_job_id = gr.Textbox(label="Job ID")
+                            theme_job_status = gr.Textbox(label="Job Status", interactive=False)
+                            theme_job_shown = gr.State(None)
+                        with gr.Row():
+                            theme_submit_button = gr.Button("Submit as Job")
+                            theme_cancel_button = gr.Button("Cancel Job")
+                        theme_submit_button.click(submit_themes_job, inputs=[theme_list_str, subtitles_path, save_path, theme_engine], outputs=[theme_job_id])
+                        theme_cancel_button.click(cancel_job, inputs=[theme_job_id], outputs=[theme_job_status])
+                        gr.Timer(2).tick(poll_themes_job, inputs=[theme_job_id, theme_job_shown], outputs=[theme_job_status, output_table, theme_job_shown])
 
             # Character Network Section
         with gr.Row():
@@ -93,8 +226,40 @@ def main():
                     with gr.Column():
                         subtitles_path = gr.Textbox(label="Subtitles or Script Path")
                         ner_path = gr.Textbox(label="NERs save path")
+                        with gr.Row():
+                            episode_start = gr.Number(label="From Episode", precision=0, value=None)
+                            episode_end = gr.Number(label="To Episode", precision=0, value=None)
+                        with gr.Row():
+                            network_layout = gr.Dropdown(label="Layout", choices=["force", "spectral", "physics"], value="force")
+                            min_weight = gr.Number(label="Min Edge Weight", precision=0, value=1)
                         get_network_graph_button = gr.Button("Get Character Network")
-                        get_network_graph_button.click(get_character_network, inputs=[subtitles_path,ner_path], outputs=[network_html])
+                        get_network_graph_button.click(get_character_network, inputs=[subtitles_path,ner_path,episode_start,episode_end,network_layout,min_weight], outputs=[network_html])
+                        with gr.Row():
+                            network_job_id = gr.Textbox(label="Job ID")
+                            network_job_status = gr.Textbox(label="Job Status", interactive=False)
+                            network_job_shown = gr.State(None)
+                        with gr.Row():
+                            network_submit_button = gr.Button("Submit as Job")
+                            network_cancel_button = gr.Button("Cancel Job")
+                        network_submit_button.click(submit_network_job, inputs=[subtitles_path,ner_path,episode_start,episode_end,network_layout,min_weight], outputs=[network_job_id])
+                        network_cancel_button.click(cancel_job, inputs=[network_job_id], outputs=[network_job_status])
+                        gr.Timer(2).tick(poll_network_job, inputs=[network_job_id, network_job_shown], outputs=[network_job_status, network_html, network_job_shown])
+
+        # Themes and character network in one resumable run
+        with gr.Row():
+            with gr.Column():
+                gr.HTML("<h1>Full Analysis (Themes and Character Network)</h1>")
+                with gr.Row():
+                    with gr.Column():
+                        analysis_table = gr.Dataframe(label="Theme Scores")
+                        analysis_html = gr.HTML()
+                    with gr.Column():
+                        analysis_theme_list = gr.Textbox(label="Theme List", placeholder="Enter themes separated by commas")
+                        analysis_subtitles_path = gr.Textbox(label="Subtitles or Script Path")
+                        analysis_engine = gr.Dropdown(label="Theme Engine", choices=["nli", "embedding"], value="nli")
+                        analysis_layout = gr.Dropdown(label="Layout", choices=["force", "spectral", "physics"], value="force")
+                        analysis_button = gr.Button("Run Full Analysis")
+                        analysis_button.click(run_full_analysis, inputs=[analysis_theme_list, analysis_subtitles_path, analysis_engine, analysis_layout], outputs=[analysis_table, analysis_html])
 
         # Jutsu Classification with LLMs
         with gr.Row():
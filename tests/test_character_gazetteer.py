@@ -0,0 +1,27 @@
+from character_network.character_gazetteer import CharacterGazetteer
+
+
+def test_overlapping_aliases_take_the_leftmost_longest_match():
+    gazetteer = CharacterGazetteer({"Naruto": "Naruto", "Naruto Uzumaki": "Naruto", "Uzumaki": "Kushina"})
+    assert gazetteer.find("Naruto Uzumaki is here") == [(0, 14, "Naruto")]
+    assert gazetteer.get_names("Uzumaki clan") == {"Kushina"}
+
+
+def test_whole_words_only():
+    gazetteer = CharacterGazetteer({"Sai": "Sai", "Naruto": "Naruto"})
+    assert gazetteer.get_names("Sai said the Narutos were loud.") == {"Sai"}
+    assert gazetteer.get_names("Naruto, Sai!") == {"Naruto", "Sai"}
+
+
+def test_case_handling():
+    alias_table = {"Sakura": "Sakura"}
+    assert CharacterGazetteer(alias_table).get_names("sakura trees") == set()
+    assert CharacterGazetteer(alias_table, case_sensitive=False).get_names("SAKURA!") == {"Sakura"}
+
+
+def test_from_naruto_csv_skips_role_speakers():
+    gazetteer = CharacterGazetteer.from_naruto_csv("data/naruto.csv")
+    names = set(gazetteer.alias_table.values())
+    assert {"Naruto", "Iruka", "Sakura"} <= names
+    assert not names & {"Ninja", "Kid"}
+    assert "Naruto Clone" not in gazetteer.alias_table
@@ -0,0 +1,34 @@
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+from character_chatbot.inference_server import ChatInferenceServer
+
+
+def get_tiny_model():
+    torch.manual_seed(0)
+    config = LlamaConfig(vocab_size=64, hidden_size=16, intermediate_size=32, num_hidden_layers=2,
+                         num_attention_heads=2, num_key_value_heads=2, max_position_embeddings=128)
+    return LlamaForCausalLM(config).eval()
+
+
+def test_failing_forward_fails_requests_and_keeps_serving():
+    model = get_tiny_model()
+    forward = model.forward
+    calls = {"count": 0}
+
+    def failing_forward(*args, **kwargs):
+        calls["count"] += 1
+        if calls["count"] == 1:
+            raise RuntimeError("out of memory")
+        return forward(*args, **kwargs)
+
+    model.forward = failing_forward
+    server = ChatInferenceServer(model, eos_token_ids=[], max_new_tokens=4).start()
+
+    with pytest.raises(RuntimeError, match="out of memory"):
+        list(server.stream([1, 2, 3]))
+
+    assert server.thread.is_alive()
+    assert len(list(server.stream([1, 2, 3]))) == 4
+    assert server.metrics()["failed_requests"] == 1
+    assert server.metrics()["active_requests"] == 0
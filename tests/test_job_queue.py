@@ -0,0 +1,48 @@
+import time
+from utils.job_queue import JobQueue
+
+
+def count_job(params, progress_callback=None):
+    # Module level, so spawned workers can unpickle it
+    for step in range(params["steps"]):
+        time.sleep(params.get("step_seconds", 0.05))
+        progress_callback("count", step + 1, params["steps"], None)
+    return {"steps": params["steps"]}
+
+
+def wait_for(job_queue, job_id, statuses, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_queue.status(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(f"Job {job_id} never reached {statuses}")
+
+
+def test_dedup_cancel_and_results_from_store(tmp_path):
+    store_path = str(tmp_path / "store.sqlite")
+    job_queue = JobQueue(store_path, max_workers=1)
+    try:
+        # Identical in-flight requests share one job
+        first = job_queue.submit("count", count_job, {"steps": 3})
+        assert job_queue.submit("count", count_job, {"steps": 3}) == first
+        assert wait_for(job_queue, first, ["done"])["result"] == {"steps": 3}
+
+        # A cancelled running job is not reused by a resubmit of the same params
+        running = job_queue.submit("count", count_job, {"steps": 200})
+        wait_for(job_queue, running, ["running"])
+        while not job_queue.status(running)["progress"]:
+            time.sleep(0.05)
+        assert job_queue.cancel(running)
+        resubmitted = job_queue.submit("count", count_job, {"steps": 200})
+        assert resubmitted != running
+        assert wait_for(job_queue, running, ["cancelled"])["status"] == "cancelled"
+        assert job_queue.cancel(resubmitted)
+        wait_for(job_queue, resubmitted, ["cancelled"])
+    finally:
+        job_queue.shutdown()
+
+    # Finished jobs are read back from the result store by a fresh queue
+    job = JobQueue(store_path).status(first)
+    assert job["status"] == "done" and job["result"] == {"steps": 3}
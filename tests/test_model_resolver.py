@@ -0,0 +1,38 @@
+import huggingface_hub
+import pytest
+from utils import model_resolver
+
+
+@pytest.fixture(autouse=True)
+def online_hub(monkeypatch, tmp_path):
+    monkeypatch.setenv("local_model_dir", str(tmp_path))
+    for name in ("HF_HUB_OFFLINE", "TRANSFORMERS_OFFLINE", "model_resolver_offline"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(model_resolver, "find_in_hub_cache", lambda model_path: False)
+    monkeypatch.setattr(model_resolver, "hub_repo_cache", {})
+
+
+def test_hub_errors_are_raised_and_not_cached(monkeypatch):
+    answers = [ConnectionError("network down"), True]
+
+    def repo_exists(model_path):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(huggingface_hub, "repo_exists", repo_exists)
+    with pytest.raises(model_resolver.HubUnavailableError):
+        model_resolver.resolve_model("user/model")
+    assert model_resolver.resolve_model("user/model") == "user/model"
+
+
+def test_forget_model_only_drops_that_model(monkeypatch):
+    calls = []
+    monkeypatch.setattr(huggingface_hub, "repo_exists", lambda model_path: calls.append(model_path) or False)
+    model_resolver.resolve_model("user/a")
+    model_resolver.resolve_model("user/b")
+    model_resolver.forget_model("user/a")
+    model_resolver.resolve_model("user/a")
+    model_resolver.resolve_model("user/b")
+    assert calls == ["user/a", "user/b", "user/a"]
@@ -0,0 +1,31 @@
+import pytest
+import spacy
+from character_network.named_entity_recognizer import NamedEntityRecognizer
+
+
+@pytest.fixture(autouse=True)
+def rule_based_model(monkeypatch):
+    # Stands in for the statistical model: finds both Naruto and Jiraiya as PERSON
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "PERSON", "pattern": "Naruto"}, {"label": "PERSON", "pattern": "Jiraiya"}])
+    monkeypatch.setattr(NamedEntityRecognizer, "load_model", lambda self: nlp)
+
+
+def test_spacy_engine_keeps_names_outside_the_gazetteer():
+    sentences = ["Naruto trained with Jiraiya.", "Jiraiya left."]
+    ner = NamedEntityRecognizer(gazetteer={"Naruto": "Naruto"})
+    expected = [{"Naruto", "Jiraiya"}, {"Jiraiya"}]
+
+    assert ner.get_ners_batched([sentences]) == [expected]
+    assert ner.get_ners_inference(" ".join(sentences), sentences) == expected
+    assert NamedEntityRecognizer().get_ners_batched([sentences]) == [expected]
+
+
+def test_hybrid_engine_skips_the_model_on_gazetteer_hits():
+    sentences = ["Naruto trained with Jiraiya.", "Jiraiya left."]
+    ner = NamedEntityRecognizer(gazetteer={"Naruto": "Naruto"}, engine="hybrid")
+    expected = [{"Naruto"}, {"Jiraiya"}]
+
+    assert ner.get_ners_batched([sentences]) == [expected]
+    assert ner.get_ners_inference(" ".join(sentences), sentences) == expected
@@ -0,0 +1,31 @@
+import os
+from utils.onnx_backend import get_cache_dir, get_model_fingerprint
+
+
+def write_model(model_dir, config, weights):
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, "config.json"), "w") as file:
+        file.write(config)
+    with open(os.path.join(model_dir, "model.safetensors"), "w") as file:
+        file.write(weights)
+
+
+def test_retraining_into_the_same_folder_changes_the_cache_dir(tmp_path):
+    model_dir = str(tmp_path / "model")
+    write_model(model_dir, '{"num_labels": 3}', "old weights")
+    first = get_model_fingerprint(model_dir)
+    assert get_model_fingerprint(model_dir) == first
+
+    write_model(model_dir, '{"num_labels": 3}', "retrained weights")
+    second = get_model_fingerprint(model_dir)
+    assert second != first
+    assert get_cache_dir(model_dir, str(tmp_path), first) != get_cache_dir(model_dir, str(tmp_path), second)
+
+
+def test_tokenizer_files_do_not_change_the_fingerprint(tmp_path):
+    model_dir = str(tmp_path / "model")
+    write_model(model_dir, '{"num_labels": 3}', "weights")
+    first = get_model_fingerprint(model_dir)
+    with open(os.path.join(model_dir, "tokenizer.json"), "w") as file:
+        file.write("{}")
+    assert get_model_fingerprint(model_dir) == first
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+from utils.pipeline_runner import PipelineRunner, PipelineStage
+
+
+def get_episodes(num_episodes=10):
+    return pd.DataFrame({"episode": range(num_episodes), "file_hash": [f"hash-{index}" for index in range(num_episodes)]})
+
+
+class CountingStage():
+    def __init__(self, fail_on_call=None):
+        self.chunks = []
+        self.fail_on_call = fail_on_call
+
+    def __call__(self, chunk):
+        self.chunks.append(chunk['episode'].tolist())
+        if len(self.chunks) == self.fail_on_call:
+            raise RuntimeError("process died")
+        return [{"score": episode / 2} for episode in chunk['episode']]
+
+
+def test_resume_from_partial_checkpoints(tmp_path):
+    runner = PipelineRunner(str(tmp_path), chunk_size=3)
+    df = get_episodes()
+
+    crashing = CountingStage(fail_on_call=3)
+    with pytest.raises(RuntimeError):
+        runner.run(df, [PipelineStage("themes", crashing)])
+
+    # The two chunks finished before the crash are not computed again
+    resumed = CountingStage()
+    results = runner.run(df, [PipelineStage("themes", resumed)])["themes"]
+    assert resumed.chunks == [[6, 7, 8], [9]]
+    assert results == [{"score": episode / 2} for episode in range(10)]
+
+
+def test_changed_episode_invalidates_only_its_chunk(tmp_path):
+    runner = PipelineRunner(str(tmp_path), chunk_size=3)
+    df = get_episodes()
+    runner.run(df, [PipelineStage("themes", CountingStage())])
+
+    df.loc[4, "file_hash"] = "hash-4-edited"
+    rerun = CountingStage()
+    runner.run(df, [PipelineStage("themes", rerun)])
+    assert rerun.chunks == [[3, 4, 5]]
+
+    # Other parameters are a different stage key, so nothing is reused
+    other_params = CountingStage()
+    runner.run(df, [PipelineStage("themes", other_params, {"model": "other"})])
+    assert len(other_params.chunks) == 4
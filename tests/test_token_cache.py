@@ -0,0 +1,43 @@
+import os
+from transformers import BertTokenizer
+from theme_classifier.token_cache import PairTokenCache
+
+VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "naruto", "are", "you", "listening", "this",
+         "example", "is", "friendship", "battle", "love", ",", "?", ".", "sasuke", "left"]
+
+
+def get_tokenizer(tmp_path):
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(VOCAB))
+    return BertTokenizer(str(vocab_path), model_max_length=64)
+
+
+def test_new_entries_are_written_in_batches(tmp_path):
+    tokenizer = get_tokenizer(tmp_path)
+    cache_path = str(tmp_path / "cache" / "tokens.pkl")
+    cache = PairTokenCache(tokenizer, "This example is {}.", cache_path=cache_path, save_interval=3600)
+
+    pairs = [("Naruto, are you listening?", "battle"), ("Sasuke left.", "love")]
+    expected = tokenizer([premise for premise, _ in pairs], ["This example is {}.".format(label) for _, label in pairs],
+                         truncation="only_first")['input_ids']
+    assert cache.encode_pairs(pairs) == expected
+    cache.encode_pairs([("Sasuke left.", "friendship")])
+    assert not os.path.exists(cache_path)
+
+    cache.flush()
+    mtime = os.path.getmtime(cache_path)
+    # Nothing new: flushing again does not rewrite the file
+    cache.encode_pairs(pairs)
+    cache.flush()
+    assert os.path.getmtime(cache_path) == mtime
+
+    reloaded = PairTokenCache(tokenizer, "This example is {}.", cache_path=cache_path)
+    assert len(reloaded.premise_ids) == 2 and set(reloaded.hypothesis_ids) == {"battle", "love", "friendship"}
+    assert reloaded.encode_pairs(pairs) == expected
+
+
+def test_save_interval_bounds_unflushed_entries(tmp_path):
+    cache_path = str(tmp_path / "tokens.pkl")
+    cache = PairTokenCache(get_tokenizer(tmp_path), "This example is {}.", cache_path=cache_path, save_interval=0)
+    cache.encode_pairs([("Sasuke left.", "love")])
+    assert os.path.exists(cache_path)
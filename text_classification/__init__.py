@@ -1 +1,5 @@
-from .jutsu_classifier import JutsuClassifier
\ No newline at end of file
+from utils.lazy_import import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "JutsuClassifier": ".jutsu_classifier",
+})
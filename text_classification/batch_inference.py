@@ -0,0 +1,163 @@
+"""Bulk Jutsu classification.
+
+    python -m text_classification.batch_inference --model-path <hub id or folder> --data-path data/jujutsu.jsonl
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import math
+import multiprocessing
+import os
+import time
+import numpy as np
+import pandas as pd
+import torch
+
+worker_model = None
+worker_tokenizer = None
+
+
+def read_text_chunks(data_path, text_column='text', chunk_size=4096):
+    # JSONL/CSV are read chunk by chunk; jutsu records without a text column get "name. description" as in training
+    if data_path.endswith('.csv'):
+        reader = pd.read_csv(data_path, chunksize=chunk_size)
+    else:
+        reader = pd.read_json(data_path, lines=True, chunksize=chunk_size)
+
+    for df in reader:
+        if text_column in df.columns:
+            texts = df[text_column]
+        else:
+            texts = df['jutsu_name'] + ". " + df['jutsu_description']
+        yield texts.fillna("").astype(str).tolist()
+
+
+def iter_text_chunks(inputs, text_column='text', chunk_size=4096):
+    if isinstance(inputs, str):
+        yield from read_text_chunks(inputs, text_column=text_column, chunk_size=chunk_size)
+        return
+    iterator = iter(inputs)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def clean_texts(texts):
+    # The same cleaning the training texts get, so predictions see the same input
+    from .cleaner import Cleaner
+
+    cleaner = Cleaner()
+    return [cleaner.clean(text) for text in texts]
+
+
+def split_chunk(chunk, parts):
+    size = math.ceil(len(chunk) / parts)
+    return [chunk[start:start + size] for start in range(0, len(chunk), size)]
+
+
+def predict_logits(model, tokenizer, texts, batch_size=64, max_length=None):
+    # Longest texts first so every batch is padded to a similar length; results go back in input order
+    order = np.argsort([-len(text) for text in texts], kind="stable")
+    logits = None
+
+    for start in range(0, len(order), batch_size):
+        batch_index = order[start:start + batch_size]
+        batch_texts = [texts[index] for index in batch_index]
+        if hasattr(model, 'predict_logits'):
+            batch = tokenizer(batch_texts, padding=True, truncation=True, max_length=max_length, return_tensors="np")
+            batch_logits = model.predict_logits(batch["input_ids"], batch["attention_mask"])
+        else:
+            batch = tokenizer(batch_texts, padding=True, truncation=True, max_length=max_length, return_tensors="pt").to(model.device)
+            with torch.no_grad():
+                batch_logits = model(**batch).logits.float().cpu().numpy()
+
+        if logits is None:
+            logits = np.zeros((len(texts), batch_logits.shape[1]), dtype=np.float32)
+        logits[batch_index] = batch_logits
+
+    return logits if logits is not None else np.zeros((0, model.config.num_labels), dtype=np.float32)
+
+
+def init_worker(model_path, backend='torch', onnx_cache_dir=None, num_threads=1):
+    # Each worker process loads its own copy of the model once
+    global worker_model, worker_tokenizer
+    from .jutsu_classifier import load_classification_model
+
+    torch.set_num_threads(num_threads)
+    pipeline = load_classification_model(model_path,
+                                         backend=backend,
+                                         device='cpu',
+                                         onnx_cache_dir=onnx_cache_dir,
+                                         num_threads=num_threads)
+    worker_model, worker_tokenizer = pipeline.model, pipeline.tokenizer
+
+
+def predict_worker(texts, batch_size=64, max_length=None):
+    return predict_logits(worker_model, worker_tokenizer, texts, batch_size=batch_size, max_length=max_length)
+
+
+def classify_chunks(chunks, model, tokenizer, model_path, backend='torch', onnx_cache_dir=None,
+                    batch_size=64, max_length=None, num_workers=1):
+    # Yields one logits array per chunk, in input order
+    if num_workers <= 1:
+        for chunk in chunks:
+            yield predict_logits(model, tokenizer, chunk, batch_size=batch_size, max_length=max_length)
+        return
+
+    # Every chunk is split across all workers, so a file smaller than one chunk still keeps them all busy
+    pieces_per_chunk = []
+
+    def iter_pieces():
+        for chunk in chunks:
+            pieces = split_chunk(chunk, num_workers)
+            pieces_per_chunk.append(len(pieces))
+            yield from pieces
+
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    # spawn: forking a process that already runs torch threads can deadlock
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker,
+                             initargs=(model_path, backend, onnx_cache_dir, num_threads)) as executor:
+        # map submits every piece up front, so pieces_per_chunk is complete once it returns
+        piece_logits = executor.map(predict_worker, iter_pieces(), itertools.repeat(batch_size), itertools.repeat(max_length))
+        for num_pieces in pieces_per_chunk:
+            yield np.concatenate([next(piece_logits) for _ in range(num_pieces)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--data-path", default="data/jujutsu.jsonl")
+    parser.add_argument("--text-column", default="text")
+    parser.add_argument("--output-path", default=None, help="CSV with the predicted label of every row")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx"])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--num-workers", type=int, default=1)
+    parser.add_argument("--max-length", type=int, default=None)
+    args = parser.parse_args()
+
+    from .jutsu_classifier import JutsuClassifier
+
+    classifier = JutsuClassifier(args.model_path, backend=args.backend)
+    start_time = time.time()
+    logits, predictions = classifier.classify_many(args.data_path,
+                                                   text_column=args.text_column,
+                                                   batch_size=args.batch_size,
+                                                   chunk_size=args.chunk_size,
+                                                   num_workers=args.num_workers,
+                                                   max_length=args.max_length)
+    seconds = time.time() - start_time
+
+    labels = classifier.get_labels()
+    print(f"Classified {len(predictions)} texts in {seconds:.1f}s ({len(predictions) / seconds:.1f} texts/sec)")
+    print(pd.Series([labels[index] for index in predictions]).value_counts().to_string())
+    if args.output_path:
+        pd.DataFrame({"label": [labels[index] for index in predictions]}).to_csv(args.output_path, index=False)
+
+
+if __name__ == "__main__":
+    main()
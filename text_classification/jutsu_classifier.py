@@ -1,14 +1,45 @@
 import torch
-import huggingface_hub
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, TrainingArguments, DataCollatorWithPadding, pipeline
+from transformers import AutoTokenizer, pipeline
 import pandas as pd
-from .cleaner import Cleaner
-from sklearn import preprocessing
-from sklearn.model_selection import train_test_split
-from datasets import Dataset
-from .training_utils import get_class_weights, compute_metrics
-from .trainer import CustomTrainer
+import numpy as np
 import gc
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import pathlib
+folder_path = pathlib.Path(__file__).parent.resolve()
+sys.path.append(os.path.join(folder_path,'../'))
+from utils.onnx_backend import load_onnx_model, OnnxTextClassifier
+from utils.model_registry import model_registry
+from utils.model_resolver import resolve_model, forget_model, login_once
+from .batch_inference import iter_text_chunks, clean_texts, predict_logits, classify_chunks
+
+DEFAULT_DATA_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nlp_series_analysis", "jutsu_data")
+DATA_CACHE_VERSION = 1
+
+
+def load_classification_model(model_path, backend='torch', device='cpu', onnx_cache_dir=None, num_threads=None):
+    # Shared by JutsuClassifier and the batch inference workers, so both load the same way
+    if backend == 'onnx':
+        onnx_model, tokenizer = model_registry.get(
+            ("text-classification", model_path, "onnx-int8", "cpu"),
+            lambda: load_onnx_model(model_path,
+                                    cache_dir=onnx_cache_dir,
+                                    num_threads=num_threads)
+        )
+        return OnnxTextClassifier(onnx_model, tokenizer)
+
+    model = model_registry.get(
+        ("text-classification", model_path, "torch", device),
+        lambda: pipeline("text-classification",
+                         model=model_path,
+                         device=0 if device == 'cuda' else -1,
+                         top_k=None)  # Use top_k instead of return_all_scores
+    )
+    return model
 
 
 class JutsuClassifier():
@@ -20,7 +51,13 @@ class JutsuClassifier():
                     model_name='distilbert/distilbert-base-uncased', 
                     test_size = 0.2,
                     num_label = 3,
-                    huggingface_token=None
+                    huggingface_token=None,
+                    backend='torch',
+                    onnx_cache_dir=None,
+                    num_threads=None,
+                    max_length=None,
+                    group_by_length=True,
+                    data_cache_dir=None
                     ):
         self.model_path = model_path
         self.data_path = data_path
@@ -31,19 +68,28 @@ class JutsuClassifier():
         self.num_label = num_label
         self.huggingface_token = huggingface_token
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.backend = backend
+        self.onnx_cache_dir = onnx_cache_dir
+        self.num_threads = num_threads
+        self.max_length = max_length
+        self.group_by_length = group_by_length
+        self.data_cache_dir = data_cache_dir or DEFAULT_DATA_CACHE_DIR
 
         self.huggingface_token = huggingface_token
 
-        if self.huggingface_token is not None:
-            huggingface_hub.login(self.huggingface_token)
+        login_once(self.huggingface_token)
 
+        # Local folder, manifest entry or Hub cache first; the Hub is only asked once per process
+        self.resolved_model_path = resolve_model(self.model_path)
         self.tokenizer = self.load_tokenizer()
 
-        if not huggingface_hub.repo_exists(self.model_path):
+        if self.resolved_model_path is None:
             # If the data path is provided
             if self.data_path is  None:
                 raise ValueError("The data path is provided but the model path is not found in Hugging Face Hub. Please provide a valid model path or set the data path to None.")
             
+            from .training_utils import get_class_weights
+
             train_data,test_data = self.load_data(self.data_path)
             train_data_df = train_data.to_pandas()
             test_data_df = test_data.to_pandas()
@@ -51,9 +97,16 @@ class JutsuClassifier():
             class_weights = get_class_weights(all_data)
 
             self.train_model(train_data, test_data, class_weights)
+            forget_model(self.model_path)
+            self.resolved_model_path = resolve_model(self.model_path) or self.model_path
 
-        self.model = self.load_model(self.model_path)
+        self.model = self.load_model(self.resolved_model_path)
     def train_model(self, train_data, test_data, class_weights):
+        # The training stack is only imported when a model actually has to be trained
+        from transformers import AutoModelForSequenceClassification, TrainingArguments, DataCollatorWithPadding
+        from .training_utils import compute_metrics
+        from .trainer import CustomTrainer
+
         model = AutoModelForSequenceClassification.from_pretrained(self.model_name,
                                                                   num_labels=self.num_label,
                                                                   id2label=self.label_dict,
@@ -69,6 +122,9 @@ class JutsuClassifier():
             weight_decay=0.01,
             evaluation_strategy="epoch",
             logging_strategy="epoch",
+            # Batches of similar lengths, so dynamic padding adds few pad tokens
+            group_by_length=self.group_by_length,
+            length_column_name="length",
             
             metric_for_best_model="accuracy",
             push_to_hub=True,
@@ -98,10 +154,65 @@ class JutsuClassifier():
             torch.cuda.empty_cache()
 
     def preprocess_function(self, tokenizer, examples):
-        return tokenizer(examples['text_cleaned'], truncation=True)
+        tokenized = tokenizer(examples['text_cleaned'], truncation=True, max_length=self.max_length)
+        tokenized['length'] = [len(input_ids) for input_ids in tokenized['input_ids']]
+        return tokenized
 
+    def get_data_cache_path(self, data_path):
+        # Anything that changes the cleaned and tokenized splits is part of the key
+        from utils.corpus_cache import hash_file
+
+        cache_key = json.dumps({
+            "version": DATA_CACHE_VERSION,
+            "data_hash": hash_file(data_path),
+            "tokenizer": self.tokenizer.name_or_path,
+            "tokenizer_class": self.tokenizer.__class__.__name__,
+            "vocab_size": len(self.tokenizer),
+            "max_length": self.max_length,
+            "test_size": self.test_size,
+            "label_column_name": self.label_column_name,
+        }, sort_keys=True)
+        return os.path.join(self.data_cache_dir, hashlib.sha1(cache_key.encode("utf-8")).hexdigest()[:16])
 
     def load_data(self,data_path):
+        # Cleaned and tokenized splits are saved as Arrow files and memory-mapped on the next run
+        from datasets import load_from_disk
+
+        cache_path = self.get_data_cache_path(data_path)
+        if os.path.exists(os.path.join(cache_path, "label_dict.json")):
+            with open(os.path.join(cache_path, "label_dict.json")) as file:
+                self.label_dict = {int(index): label_name for index, label_name in json.load(file).items()}
+            return load_from_disk(os.path.join(cache_path, "train")), load_from_disk(os.path.join(cache_path, "test"))
+
+        tokenized_train, tokenized_test = self.prepare_data(data_path)
+
+        # A temp folder per writer, so two processes preparing the same data don't write into each other
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+        try:
+            tokenized_train.save_to_disk(os.path.join(tmp_path, "train"))
+            tokenized_test.save_to_disk(os.path.join(tmp_path, "test"))
+            with open(os.path.join(tmp_path, "label_dict.json"), "w") as file:
+                json.dump(self.label_dict, file, indent=2)
+            shutil.rmtree(cache_path, ignore_errors=True)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # The key is a content hash: if another process completed the same cache first, use theirs
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.exists(os.path.join(cache_path, "label_dict.json")):
+                raise
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        return load_from_disk(os.path.join(cache_path, "train")), load_from_disk(os.path.join(cache_path, "test"))
+
+    def prepare_data(self,data_path):
+        from sklearn import preprocessing
+        from sklearn.model_selection import train_test_split
+        from datasets import Dataset
+        from .cleaner import Cleaner
+
         df = pd.read_json(data_path,lines=True)
         df['jutsu_type_simplified'] = df['jutsu_type'].apply(self.simplify_jutsu)
         df['text'] = df['jutsu_name'] + ". " + df['jutsu_description']
@@ -121,11 +232,11 @@ class JutsuClassifier():
         self.label_dict = label_dict
         df['label'] = le.transform(df[self.label_column_name].tolist())
 
-        # Train / Test Split
-        test_size = 0.2
+        # Train / Test Split (seeded, so a cached split is the split a fresh run would make)
         df_train, df_test = train_test_split(df, 
-                                            test_size=test_size, 
-                                            stratify=df['label'],)
+                                            test_size=self.test_size, 
+                                            stratify=df['label'],
+                                            random_state=42)
         
         # Conver Pandas to a hugging face dataset
         train_dataset = Dataset.from_pandas(df_train)
@@ -140,8 +251,8 @@ class JutsuClassifier():
         return tokenized_train, tokenized_test
 
     def load_tokenizer(self):
-        if huggingface_hub.repo_exists(self.model_path):
-            tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+        if self.resolved_model_path is not None:
+            tokenizer = AutoTokenizer.from_pretrained(self.resolved_model_path)
         else:
             tokenizer = AutoTokenizer.from_pretrained(self.model_name)
         return tokenizer
@@ -156,24 +267,38 @@ class JutsuClassifier():
     
 
     def load_model(self, model_path):
-        model = pipeline("text-classification",
-                         model=model_path,
-                         device=0 if self.device == 'cuda' else -1,
-                         top_k=None)  # Use top_k instead of return_all_scores
-        return model
-    def postprocess_output(self, model_output):
-        output = []
-        for item in model_output:
-            label = max(item, key=lambda x:x['score'])['label']
-            output.append(label)
-        return output
+        return load_classification_model(model_path,
+                                         backend=self.backend,
+                                         device=self.device,
+                                         onnx_cache_dir=self.onnx_cache_dir,
+                                         num_threads=self.num_threads)
+    def get_labels(self):
+        id2label = self.model.model.config.id2label
+        return [id2label[index] for index in range(len(id2label))]
+
+    def classify_many(self, inputs, text_column='text', batch_size=64, chunk_size=4096, num_workers=1, max_length=None):
+        # inputs: a JSONL/CSV path or any iterable of texts; returns (logits, argmax) NumPy arrays in input order
+        chunks = (clean_texts(chunk) for chunk in iter_text_chunks(inputs, text_column=text_column, chunk_size=chunk_size))
+        logits = list(classify_chunks(chunks,
+                                      self.model.model,
+                                      self.model.tokenizer,
+                                      self.resolved_model_path,
+                                      backend=self.backend,
+                                      onnx_cache_dir=self.onnx_cache_dir,
+                                      batch_size=batch_size,
+                                      max_length=max_length,
+                                      num_workers=num_workers))
+        logits = np.concatenate(logits) if logits else np.zeros((0, len(self.get_labels())), dtype=np.float32)
+        return logits, logits.argmax(axis=1)
+
     def classify_jutsu(self, text):
         # Ensure the input is a list
         if isinstance(text, str):
             text = [text]  # Wrap the single string in a list
 
-        model_output = self.model(text)
-        prediction = self.postprocess_output(model_output)
+        logits = predict_logits(self.model.model, self.model.tokenizer, clean_texts(text))
+        labels = self.get_labels()
+        prediction = [labels[index] for index in logits.argmax(axis=1)]
         return prediction
 
 
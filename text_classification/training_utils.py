@@ -1,15 +1,23 @@
-from sklearn.utils.class_weight import compute_class_weight
 import numpy as np
-import evaluate
 
-metric = evaluate.load('accuracy')
+metric = None
+
+def get_metric():
+    # evaluate.load reads the metric script from the Hub, so only do it once training starts
+    global metric
+    if metric is None:
+        import evaluate
+        metric = evaluate.load('accuracy')
+    return metric
 
 def compute_metrics(eval_pred):
     logits, labels = eval_pred
     predictions = np.argmax(logits, axis=1)
-    return metric.compute(predictions=predictions, references=labels)
+    return get_metric().compute(predictions=predictions, references=labels)
 
 def get_class_weights(df):
+    from sklearn.utils.class_weight import compute_class_weight
+
     # Ensure that the 'label' column exists
     if 'label' not in df.columns:
         raise ValueError("The input DataFrame must contain a 'label' column.")
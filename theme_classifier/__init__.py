@@ -1 +1,5 @@
-from .theme_classifier import ThemeClassifier
\ No newline at end of file
+from utils.lazy_import import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "ThemeClassifier": ".theme_classifier",
+})
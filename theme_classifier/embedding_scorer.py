@@ -0,0 +1,86 @@
+import numpy as np
+
+
+def sigmoid(values):
+    return 1 / (1 + np.exp(-values))
+
+
+class EmbeddingThemeScorer():
+    def __init__(self, encoder, hypothesis_template="This example is {}.", nli_scorer=None, rerank_top_k=None, calibration=None):
+        self.encoder = encoder
+        self.hypothesis_template = hypothesis_template
+        self.nli_scorer = nli_scorer
+        self.rerank_top_k = rerank_top_k
+        # (slope, intercept) mapping cosine similarity to an NLI-like probability
+        self.calibration = calibration
+        self.label_embeddings = {}
+
+        if self.rerank_top_k and self.nli_scorer is None:
+            raise ValueError("rerank_top_k needs an NLI scorer to re-rank with.")
+
+    def get_label_embeddings(self, labels):
+        new_labels = [label for label in labels if label not in self.label_embeddings]
+        if new_labels:
+            hypotheses = [self.hypothesis_template.format(label) for label in new_labels]
+            for label, embedding in zip(new_labels, self.encoder.encode(hypotheses)):
+                self.label_embeddings[label] = embedding
+        return np.stack([self.label_embeddings[label] for label in labels])
+
+    def get_similarities(self, premises, labels):
+        premise_embeddings = self.encoder.encode(premises)
+        label_embeddings = self.get_label_embeddings(labels)
+        # Embeddings are L2-normalized, so the dot product is the cosine similarity
+        return premise_embeddings @ label_embeddings.T
+
+    def calibrate_similarities(self, similarities):
+        if self.calibration is None:
+            return (similarities + 1) / 2
+        slope, intercept = self.calibration
+        return sigmoid(slope * similarities + intercept)
+
+    def fit_calibration(self, premises, labels, max_pairs=2000, seed=0):
+        if self.nli_scorer is None:
+            raise ValueError("Calibration needs an NLI scorer to fit against.")
+
+        similarities = self.get_similarities(premises, labels)
+        pairs = [(premise_index, label_index) for premise_index in range(len(premises)) for label_index in range(len(labels))]
+        if len(pairs) > max_pairs:
+            rng = np.random.default_rng(seed)
+            pairs = [pairs[index] for index in rng.choice(len(pairs), max_pairs, replace=False)]
+
+        nli_scores = self.nli_scorer.score_pairs([(premises[premise_index], labels[label_index]) for premise_index, label_index in pairs])
+        pair_similarities = np.array([similarities[premise_index, label_index] for premise_index, label_index in pairs])
+
+        # Least squares fit in logit space: logit(nli) ~ slope * cosine + intercept
+        nli_scores = np.clip(nli_scores, 1e-4, 1 - 1e-4)
+        slope, intercept = np.polyfit(pair_similarities, np.log(nli_scores / (1 - nli_scores)), 1)
+        self.calibration = (float(slope), float(intercept))
+        return self.calibration
+
+    def score(self, premises, labels):
+        if len(premises) == 0:
+            return np.zeros((0, len(labels)), dtype=np.float32)
+        scores = self.calibrate_similarities(self.get_similarities(premises, labels)).astype(np.float32)
+
+        if not self.rerank_top_k:
+            return scores
+
+        # Only the top-k themes per chunk go through the cross-encoder
+        top_k = min(self.rerank_top_k, len(labels))
+        top_labels = np.argsort(-scores, axis=1)[:, :top_k]
+        pairs = [(premise_index, label_index) for premise_index in range(len(premises)) for label_index in top_labels[premise_index]]
+        nli_scores = self.nli_scorer.score_pairs([(premises[premise_index], labels[label_index]) for premise_index, label_index in pairs])
+        for (premise_index, label_index), nli_score in zip(pairs, nli_scores):
+            scores[premise_index, label_index] = nli_score
+        return scores
+
+    def score_pairs(self, pairs):
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        premises = list(dict.fromkeys(premise for premise, _ in pairs))
+        labels = list(dict.fromkeys(label for _, label in pairs))
+        premise_index = {premise: index for index, premise in enumerate(premises)}
+        label_index = {label: index for index, label in enumerate(labels)}
+
+        scores = self.score(premises, labels)
+        return np.array([scores[premise_index[premise], label_index[label]] for premise, label in pairs], dtype=np.float32)
@@ -0,0 +1,74 @@
+import numpy as np
+import torch
+from .token_cache import PairTokenCache
+
+
+class NLIScorer():
+    def __init__(self, model, tokenizer, hypothesis_template="This example is {}.", batch_size=16, token_cache_path=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.hypothesis_template = hypothesis_template
+        self.batch_size = batch_size
+        self.entailment_id, self.contradiction_id = self.get_label_ids()
+
+        max_length = min(tokenizer.model_max_length, getattr(model.config, 'max_position_embeddings', tokenizer.model_max_length))
+        self.token_cache = PairTokenCache(tokenizer, hypothesis_template, max_length=max_length, cache_path=token_cache_path)
+
+    def get_label_ids(self):
+        # Same label lookup as the transformers zero-shot pipeline
+        entailment_id = -1
+        for label, label_id in self.model.config.label2id.items():
+            if label.lower().startswith("entail"):
+                entailment_id = label_id
+        contradiction_id = -1 if entailment_id == 0 else 0
+        return entailment_id, contradiction_id
+
+    def encode_pairs(self, pairs):
+        return self.token_cache.encode_pairs(pairs)
+
+    def pad_batch(self, batch_input_ids):
+        max_length = max(len(ids) for ids in batch_input_ids)
+        input_ids = torch.full((len(batch_input_ids), max_length), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch_input_ids), max_length), dtype=torch.long)
+        for row, ids in enumerate(batch_input_ids):
+            input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, :len(ids)] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+    def forward(self, batch):
+        if hasattr(self.model, 'predict_logits'):
+            return self.model.predict_logits(batch['input_ids'].numpy(), batch['attention_mask'].numpy())
+
+        device = self.model.device
+        batch = {key: value.to(device) for key, value in batch.items()}
+        with torch.no_grad():
+            logits = self.model(**batch).logits
+        return logits.float().cpu().numpy()
+
+    def score_pairs(self, pairs):
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        input_ids = self.encode_pairs(pairs)
+
+        # Longest first, so similar lengths share a batch and padding stays small
+        order = np.argsort([-len(ids) for ids in input_ids], kind="stable")
+        scores = np.zeros(len(pairs), dtype=np.float32)
+
+        for start in range(0, len(order), self.batch_size):
+            batch_index = order[start:start + self.batch_size]
+            batch = self.pad_batch([input_ids[index] for index in batch_index])
+            logits = self.forward(batch)
+
+            # multi_label: softmax over (contradiction, entailment) for each pair
+            entail_contr_logits = logits[:, [self.contradiction_id, self.entailment_id]]
+            entail_contr_logits = entail_contr_logits - entail_contr_logits.max(axis=1, keepdims=True)
+            probabilities = np.exp(entail_contr_logits)
+            probabilities = probabilities / probabilities.sum(axis=1, keepdims=True)
+            scores[batch_index] = probabilities[:, 1]
+
+        return scores
+
+    def score(self, premises, labels):
+        pairs = [(premise, label) for premise in premises for label in labels]
+        scores = self.score_pairs(pairs)
+        return scores.reshape(len(premises), len(labels))
@@ -1,45 +1,166 @@
 from transformers import pipeline
 import torch
-from nltk.tokenize import sent_tokenize
-import nltk
 import pandas as pd
 import numpy as np
+import hashlib
+import json
 import os
 import sys
-import pathlib 
-from utils.data_loader import load_subtitles_dataset
+import pathlib
 folder_path = pathlib.Path(__file__).parent.resolve()
 sys.path.append(os.path.join(folder_path,'../'))
-from utils import load_subtitles_dataset
-nltk.download('punkt')
-nltk.download('punkt_tab')
+from utils import load_cached_subtitles_dataset, ResultStore
+from utils.model_registry import model_registry
+from utils.pipeline_runner import PipelineRunner, PipelineStage
+from utils.nltk_data import sent_tokenize
+from utils.sentence_encoder import SentenceEncoder
+from utils.onnx_backend import load_onnx_model
+from .nli_scorer import NLIScorer
+from .embedding_scorer import EmbeddingThemeScorer
 
 class ThemeClassifier():
-    def __init__(self, theme_list):
+    def __init__(self,
+                 theme_list,
+                 result_store_path=None,
+                 inference_mode="corpus",
+                 batch_size=16,
+                 token_cache_path=None,
+                 engine="nli",
+                 embedding_model_name="sentence-transformers/all-MiniLM-L6-v2",
+                 rerank_top_k=None,
+                 calibration="nli",
+                 backend="torch",
+                 onnx_cache_dir=None,
+                 num_threads=None):
         self.model_name = "facebook/bart-large-mnli"
+        self.embedding_model_name = embedding_model_name
         self.device = 0 if torch.cuda.is_available() else 'cpu'
         self.theme_list = theme_list
-        self.theme_classifier = self.load_model(self.device)
-    
+        self.sentence_batch_size = 20
+        self.inference_mode = inference_mode
+        self.engine = engine
+        self.rerank_top_k = rerank_top_k
+        # Embedding engine only: "nli" fits cosine -> NLI probability on a corpus sample, a (slope, intercept)
+        # pair is used as is, None keeps the raw (cosine + 1) / 2, which is not comparable to NLI scores
+        self.calibration = calibration
+        self.calibration_sample_hash = None
+        self.backend = backend
+        self.onnx_cache_dir = onnx_cache_dir
+        self.num_threads = num_threads
+        self.result_store = ResultStore(result_store_path) if result_store_path is not None else None
+
+        if self.engine not in ("nli", "embedding"):
+            raise ValueError(f"Unknown theme engine '{self.engine}'. Use 'nli' or 'embedding'.")
+        if self.engine == "embedding" and self.inference_mode != "corpus":
+            raise ValueError("The embedding engine only supports inference_mode='corpus'.")
+        if self.backend not in ("torch", "onnx"):
+            raise ValueError(f"Unknown backend '{self.backend}'. Use 'torch' or 'onnx'.")
+        if self.backend == "onnx" and self.inference_mode != "corpus":
+            raise ValueError("The onnx backend only supports inference_mode='corpus'.")
+
+        # The NLI model is only loaded when something will use it
+        self.theme_classifier = None
+        self.nli_scorer = None
+        if self.engine == "nli" or self.rerank_top_k or self.calibration == "nli":
+            if self.backend == "onnx":
+                nli_model, nli_tokenizer = model_registry.get(
+                    ("zero-shot-classification", self.model_name, "onnx-int8", "cpu"),
+                    lambda: load_onnx_model(self.model_name,
+                                            cache_dir=self.onnx_cache_dir,
+                                            num_threads=self.num_threads,
+                                            text_pair=True)
+                )
+            else:
+                self.theme_classifier = self.load_model(self.device)
+                nli_model, nli_tokenizer = self.theme_classifier.model, self.theme_classifier.tokenizer
+            self.nli_scorer = NLIScorer(nli_model,
+                                        nli_tokenizer,
+                                        batch_size=batch_size,
+                                        token_cache_path=token_cache_path)
+
+        self.scorer = self.nli_scorer
+        if self.engine == "embedding":
+            self.scorer = self.load_embedding_scorer()
+
     def load_model(self,device):
-        theme_classifier = pipeline(
-            "zero-shot-classification",
-            model=self.model_name,
-            device=device
+        theme_classifier = model_registry.get(
+            ("zero-shot-classification", self.model_name, "torch", str(device)),
+            lambda: pipeline(
+                "zero-shot-classification",
+                model=self.model_name,
+                device=device
+            )
         )
 
         return theme_classifier
 
-    def get_themes_inference(self, script):
-        script_sentences = sent_tokenize(script)
+    def load_embedding_scorer(self):
+        encoder = SentenceEncoder(self.embedding_model_name)
+        calibration = self.calibration if isinstance(self.calibration, (tuple, list)) else None
+        embedding_scorer = EmbeddingThemeScorer(encoder,
+                                                nli_scorer=self.nli_scorer,
+                                                rerank_top_k=self.rerank_top_k,
+                                                calibration=calibration)
+        return embedding_scorer
+
+    def get_result_model_name(self):
+        if self.engine == "embedding":
+            return self.embedding_model_name
+        return self.get_nli_model_name()
+
+    def get_stage_params(self):
+        params = {"sentence_batch_size": self.sentence_batch_size}
+        if self.engine == "embedding":
+            params.update(engine=self.engine, calibration=self.calibration)
+            if self.calibration == "nli":
+                # Scores from fits on different samples must not share result store entries
+                params.update(calibration_sample=self.calibration_sample_hash)
+            if self.rerank_top_k:
+                # Which themes get re-ranked depends on the whole theme list
+                params.update(rerank_model=self.model_name, rerank_backend=self.backend, rerank_top_k=self.rerank_top_k, theme_list=sorted(self.theme_list))
+        return params
+
+    def prepare_calibration(self, df, sample_size=200, seed=0):
+        # Fit once per classifier, on a fixed sample of the whole corpus, before anything is scored or
+        # looked up; later chunks of the same run reuse it. Fits are kept in the result store by sample hash
+        if self.engine != "embedding" or self.calibration != "nli" or self.calibration_sample_hash is not None:
+            return
+        chunks = [chunk for script_sentences in df['sentences'] for chunk in self.get_script_batches(script_sentences)]
+        rng = np.random.default_rng(seed)
+        sample = [chunks[index] for index in sorted(rng.choice(len(chunks), min(sample_size, len(chunks)), replace=False))]
+        payload = json.dumps({"sample": sample, "themes": sorted(self.theme_list), "nli_model": self.get_nli_model_name()})
+        sample_hash = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+        stored = {}
+        if self.result_store is not None:
+            stored = self.result_store.get_episode_results("calibration", self.embedding_model_name, {}, [sample_hash])
+        if sample_hash in stored:
+            self.scorer.calibration = tuple(stored[sample_hash])
+        else:
+            self.scorer.fit_calibration(sample, self.theme_list)
+            if self.result_store is not None:
+                self.result_store.put_episode_results("calibration", self.embedding_model_name, {}, {sample_hash: list(self.scorer.calibration)})
+        slope, intercept = self.scorer.calibration
+        print(f"Calibrated embedding scores against NLI: slope={slope:.3f}, intercept={intercept:.3f}")
+        self.calibration_sample_hash = sample_hash
 
+    def get_nli_model_name(self):
+        return self.model_name + "@onnx-int8" if self.backend == "onnx" else self.model_name
+
+    def get_script_batches(self, script_sentences):
         # Batch Sentence
-        sentence_batch_size=20
         script_batches = []
-        for index in range(0,len(script_sentences),sentence_batch_size):
-            sent = " ".join(script_sentences[index:index+sentence_batch_size])
+        for index in range(0,len(script_sentences),self.sentence_batch_size):
+            sent = " ".join(script_sentences[index:index+self.sentence_batch_size])
             script_batches.append(sent)
-        
+        return script_batches
+
+    def get_themes_inference(self, script, script_sentences=None):
+        if script_sentences is None:
+            script_sentences = sent_tokenize(script)
+
+        script_batches = self.get_script_batches(script_sentences)
+
         # Run Model
         theme_output = self.theme_classifier(
             script_batches,
@@ -47,7 +168,7 @@ class ThemeClassifier():
             multi_label=True
         )
 
-        # Wrangle Output 
+        # Wrangle Output
         themes = {}
         for output in theme_output:
             for label,score in zip(output['labels'],output['scores']):
@@ -59,26 +180,118 @@ class ThemeClassifier():
 
         return themes
 
-    def get_themes(self,dataset_path, save_path=None):
+    def get_themes_corpus(self, df):
+        # Flatten the chunks of every episode into one scoring stream
+        chunks = []
+        chunk_episodes = []
+        for episode_index, script_sentences in enumerate(df['sentences']):
+            script_batches = self.get_script_batches(script_sentences)
+            chunks += script_batches
+            chunk_episodes += [episode_index] * len(script_batches)
+
+        print(f"Scoring {len(chunks)} chunks x {len(self.theme_list)} themes across {len(df)} episodes")
+        self.prepare_calibration(df)
+        scores = self.scorer.score(chunks, self.theme_list)
+
+        # Scatter chunk scores back to per-episode means
+        chunk_episodes = np.array(chunk_episodes, dtype=np.int64)
+        output_themes = []
+        for episode_index in range(len(df)):
+            episode_scores = scores[chunk_episodes == episode_index]
+            if len(episode_scores) == 0:
+                output_themes.append({})
+                continue
+            output_themes.append(dict(zip(self.theme_list, episode_scores.mean(axis=0))))
+        return output_themes
+
+    def get_missing_chunk_scores(self, df):
+        self.prepare_calibration(df)
+        params = self.get_stage_params()
+        episode_hashes = df['file_hash'].tolist()
+        stored_scores = self.result_store.get_chunk_scores(self.get_result_model_name(), params, episode_hashes, self.theme_list)
+
+        missing_pairs = []
+        for episode_hash, script_sentences in zip(episode_hashes, df['sentences']):
+            for chunk_index, chunk in enumerate(self.get_script_batches(script_sentences)):
+                for label in self.theme_list:
+                    if (episode_hash, chunk_index, label) not in stored_scores:
+                        missing_pairs.append((episode_hash, chunk_index, chunk, label))
+
+        # With multi_label=True every label is scored independently, so only
+        # the missing (chunk, label) pairs are run
+        print(f"Scoring {len(missing_pairs)} missing (chunk, theme) pairs")
+        if self.inference_mode == "corpus":
+            pair_scores = self.scorer.score_pairs([(chunk, label) for _, _, chunk, label in missing_pairs])
+        else:
+            pair_scores = [
+                self.theme_classifier(chunk, [label], multi_label=True)['scores'][0]
+                for _, _, chunk, label in missing_pairs
+            ]
+
+        new_scores = {}
+        for (episode_hash, chunk_index, _, label), score in zip(missing_pairs, pair_scores):
+            new_scores[(episode_hash, chunk_index, label)] = score
+
+        if new_scores:
+            self.result_store.put_chunk_scores(self.get_result_model_name(), params, new_scores)
+        stored_scores.update(new_scores)
+        return stored_scores
+
+    def get_themes_incremental(self, df):
+        chunk_scores = self.get_missing_chunk_scores(df)
+
+        # Merge chunk scores back into per-episode means
+        themes = {}
+        for (episode_hash, _, label), score in chunk_scores.items():
+            themes.setdefault(episode_hash, {}).setdefault(label, []).append(score)
+
+        output_themes = []
+        for episode_hash in df['file_hash']:
+            episode_themes = themes.get(episode_hash, {})
+            output_themes.append({label: np.mean(np.array(episode_themes[label])) for label in self.theme_list if label in episode_themes})
+        return output_themes
+
+    def get_themes_df(self, df):
+        if self.result_store is not None:
+            return self.get_themes_incremental(df)
+        if self.inference_mode == "corpus":
+            return self.get_themes_corpus(df)
+        return df.apply(lambda row: self.get_themes_inference(row['script'], row['sentences']), axis=1).tolist()
+
+    def get_pipeline_stage(self, df=None):
+        # With NLI calibration the fit on the whole corpus is part of the checkpoint key, so it comes first
+        if df is not None:
+            self.prepare_calibration(df)
+        params = dict(self.get_stage_params(), model_name=self.get_result_model_name(), theme_list=self.theme_list)
+        return PipelineStage("themes", self.get_themes_df, params)
+
+    def get_themes(self,dataset_path, save_path=None, checkpoint_dir=None, progress_callback=None):
         # Read Save Output if Exists
-        if save_path is not None and os.path.exists(save_path):
+        if self.result_store is None and save_path is not None and os.path.exists(save_path):
             df = pd.read_csv(save_path)
             return df
 
         # load Dataset
-        df = load_subtitles_dataset(dataset_path)
-        
+        df = load_cached_subtitles_dataset(dataset_path)
+
         print(f"Loaded dataset shape: {df.shape}")
-        
+
 
         # Run Inference
-        output_themes = df['script'].apply(self.get_themes_inference)
+        if checkpoint_dir is not None:
+            runner = PipelineRunner(checkpoint_dir)
+            output_themes = runner.run(df, [self.get_pipeline_stage(df)], progress_callback)["themes"]
+        else:
+            output_themes = self.get_themes_df(df)
+        if self.nli_scorer is not None:
+            self.nli_scorer.token_cache.flush()
+        df = df[['episode', 'script']].copy()
 
-        themes_df = pd.DataFrame(output_themes.tolist())
+        themes_df = pd.DataFrame(output_themes)
         df[themes_df.columns] = themes_df
 
         # Save output
         if save_path is not None:
             df.to_csv(save_path,index=False)
-        
-        return df
\ No newline at end of file
+
+        return df
@@ -0,0 +1,125 @@
+import atexit
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+import weakref
+
+
+def hash_text(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class PairTokenCache():
+    def __init__(self, tokenizer, hypothesis_template, max_length=None, cache_path=None, save_interval=60):
+        self.tokenizer = tokenizer
+        self.hypothesis_template = hypothesis_template
+        self.max_length = max_length or tokenizer.model_max_length
+        self.cache_path = cache_path
+        self.cache_key = (getattr(tokenizer, 'name_or_path', ''), type(tokenizer).__name__)
+        self.num_special_tokens = tokenizer.num_special_tokens_to_add(pair=True)
+
+        self.hypothesis_ids = {}
+        self.premise_ids = {}
+        self.dirty = False
+        # The whole pickle is rewritten on save, so new entries are written at most every save_interval
+        # seconds and once more by flush() (end of a run, or interpreter exit)
+        self.save_interval = save_interval
+        self.last_save_time = time.time()
+        self.load()
+        if self.cache_path is not None:
+            cache_ref = weakref.ref(self)
+            atexit.register(lambda: cache_ref() is not None and cache_ref().flush())
+
+        self.assemble_supported = self.check_assembly()
+
+    def load(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        with open(self.cache_path, 'rb') as file:
+            cached = pickle.load(file)
+
+        # Token ids are only valid for the tokenizer that produced them
+        if cached.get('cache_key') != self.cache_key:
+            return
+        self.premise_ids = cached['premise_ids']
+        if cached.get('hypothesis_template') == self.hypothesis_template:
+            self.hypothesis_ids = cached['hypothesis_ids']
+
+    def save(self):
+        if self.cache_path is None or not self.dirty:
+            return
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump({
+                    'cache_key': self.cache_key,
+                    'hypothesis_template': self.hypothesis_template,
+                    'hypothesis_ids': self.hypothesis_ids,
+                    'premise_ids': self.premise_ids,
+                }, file)
+            os.replace(tmp_path, self.cache_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.dirty = False
+        self.last_save_time = time.time()
+
+    def maybe_save(self):
+        if time.time() - self.last_save_time >= self.save_interval:
+            self.save()
+
+    def flush(self):
+        self.save()
+
+    def encode_text(self, text):
+        return self.tokenizer(text, add_special_tokens=False, verbose=False)['input_ids']
+
+    def get_hypothesis_ids(self, label):
+        if label not in self.hypothesis_ids:
+            self.hypothesis_ids[label] = self.encode_text(self.hypothesis_template.format(label))
+            self.dirty = True
+        return self.hypothesis_ids[label]
+
+    def get_premise_ids(self, premise):
+        key = hash_text(premise)
+        if key not in self.premise_ids:
+            self.premise_ids[key] = self.encode_text(premise)
+            self.dirty = True
+        return self.premise_ids[key]
+
+    def assemble(self, premise_ids, hypothesis_ids):
+        # Same as truncation="only_first": the premise gives way to the hypothesis
+        premise_budget = self.max_length - len(hypothesis_ids) - self.num_special_tokens
+        return self.tokenizer.build_inputs_with_special_tokens(premise_ids[:premise_budget], hypothesis_ids)
+
+    def check_assembly(self):
+        # Tokenizers without a pair-aware build_inputs_with_special_tokens
+        # fall back to the regular tokenizer call
+        premise, hypothesis = "Naruto, are you listening?", self.hypothesis_template.format("friendship")
+        expected = self.tokenizer(premise, hypothesis, truncation="only_first")['input_ids']
+        assembled = self.assemble(self.encode_text(premise), self.encode_text(hypothesis))
+        return list(assembled) == list(expected)
+
+    def encode_pairs(self, pairs):
+        if not self.assemble_supported:
+            premises = [premise for premise, _ in pairs]
+            hypotheses = [self.hypothesis_template.format(label) for _, label in pairs]
+            return self.tokenizer(premises, hypotheses, truncation="only_first")['input_ids']
+
+        # Tokenize everything not cached yet in one batched call
+        new_premises = list({premise for premise, _ in pairs if hash_text(premise) not in self.premise_ids})
+        if new_premises:
+            for premise, ids in zip(new_premises, self.tokenizer(new_premises, add_special_tokens=False, verbose=False)['input_ids']):
+                self.premise_ids[hash_text(premise)] = ids
+            self.dirty = True
+
+        input_ids = []
+        for premise, label in pairs:
+            input_ids.append(self.assemble(self.get_premise_ids(premise), self.get_hypothesis_ids(label)))
+        self.maybe_save()
+        return input_ids
@@ -1 +1,10 @@
-from .data_loader import load_subtitles_dataset
\ No newline at end of file
+from .lazy_import import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "load_subtitles_dataset": ".data_loader",
+    "iter_subtitles": ".data_loader",
+    "list_subtitle_paths": ".data_loader",
+    "SubtitleCorpusCache": ".corpus_cache",
+    "load_cached_subtitles_dataset": ".corpus_cache",
+    "ResultStore": ".result_store",
+})
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .nltk_data import ensure_nltk_data, sent_tokenize
+from .data_loader import list_subtitle_paths, iter_parsed_paths, parse_episode
+
+CACHE_FILE_NAME = '.subtitles_cache.parquet'
+
+corpus_schema = pa.schema([
+    ("path", pa.string()),
+    ("episode", pa.int64()),
+    ("file_hash", pa.string()),
+    ("mtime_ns", pa.int64()),
+    ("size", pa.int64()),
+    ("script", pa.string()),
+    ("sentences", pa.list_(pa.string())),
+])
+
+
+def hash_file(path, block_size=1 << 20):
+    file_hash = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def parse_episode_with_sentences(path):
+    parsed_episode = parse_episode(path)
+    script = " ".join(line['text'] for line in parsed_episode['lines'])
+    return {
+        "path": path,
+        "episode": parsed_episode['episode'],
+        "script": script,
+        "sentences": sent_tokenize(script),
+    }
+
+
+class SubtitleCorpusCache():
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+
+    def read(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        table = pq.read_table(self.cache_path, memory_map=True)
+        return {row['path']: row for row in table.to_pylist()}
+
+    def write(self, rows):
+        rows = sorted(rows, key=lambda row: row['episode'])
+        table = pa.Table.from_pylist(rows, schema=corpus_schema)
+
+        # Write to a temporary file first so a crash never leaves a truncated cache
+        tmp_path = self.cache_path + '.tmp'
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self.cache_path)
+
+    def load(self, dataset_path, num_workers=None):
+        cached_rows = self.read()
+        rows = []
+        stale_paths = []
+        file_info = {}
+        changed = False
+
+        for path in list_subtitle_paths(dataset_path):
+            stat = os.stat(path)
+            cached_row = cached_rows.pop(path, None)
+
+            # Same mtime and size: trust the cache without reading the file
+            if cached_row is not None and cached_row['mtime_ns'] == stat.st_mtime_ns and cached_row['size'] == stat.st_size:
+                rows.append(cached_row)
+                continue
+
+            # Touched but unchanged content: refresh the stat fields only
+            file_hash = hash_file(path)
+            if cached_row is not None and cached_row['file_hash'] == file_hash:
+                cached_row.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                rows.append(cached_row)
+                changed = True
+                continue
+
+            file_info[path] = {"file_hash": file_hash, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+            stale_paths.append(path)
+
+        # Only new or modified episodes are parsed again; the workers then find the tokenizer data locally
+        if stale_paths:
+            ensure_nltk_data()
+        for parsed_episode in iter_parsed_paths(stale_paths, parse_function=parse_episode_with_sentences, num_workers=num_workers):
+            parsed_episode.update(file_info[parsed_episode['path']])
+            rows.append(parsed_episode)
+            changed = True
+
+        # Files that disappeared from the dataset directory
+        if cached_rows:
+            changed = True
+
+        if changed:
+            print(f"Corpus cache updated: {len(stale_paths)} episodes parsed, saved to {self.cache_path}")
+            self.write(rows)
+
+        df = pd.DataFrame.from_records(rows, columns=corpus_schema.names)
+        df = df.sort_values('episode').reset_index(drop=True)
+        df['sentences'] = df['sentences'].apply(list)
+        return df
+
+
+def load_cached_subtitles_dataset(dataset_path, cache_path=None, num_workers=None):
+    if cache_path is None:
+        cache_path = os.path.join(dataset_path, CACHE_FILE_NAME)
+    corpus_cache = SubtitleCorpusCache(cache_path)
+    df = corpus_cache.load(dataset_path, num_workers=num_workers)
+    return df
@@ -1,30 +1,161 @@
-from glob import glob 
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import os
+import re
 
-def load_subtitles_dataset(dataset_path):
-    
-    subtitles_paths = glob(os.path.join(dataset_path, '*.ass'))
-    
+SUBTITLE_EXTENSIONS = ('.ass', '.srt')
 
-    scripts=[]
-    episode_num=[]
+ass_override_pattern = re.compile(r'\{[^}]*\}')
+srt_tag_pattern = re.compile(r'<[^>]+>')
+srt_timestamp_pattern = re.compile(r'(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)')
 
-    for path in subtitles_paths:
 
-        #Read Lines
-        with open(path,'r', encoding='utf-8') as file:
-            lines = file.readlines()
-            lines = lines[27:]
-            lines =  [ ",".join(line.split(',')[9:])  for line in lines ]
-        
-        lines = [ line.replace('\\N',' ') for line in lines]
-        script = " ".join(lines)
+def get_episode_number(path):
+    file_name = os.path.splitext(os.path.basename(path))[0]
+    return int(file_name.split('-')[-1].strip())
 
-        episode = int(path.split('-')[-1].split('.')[0].strip())
 
-        scripts.append(script)
-        episode_num.append(episode)
+def list_subtitle_paths(dataset_path):
+    subtitles_paths = []
+    for extension in SUBTITLE_EXTENSIONS:
+        subtitles_paths += glob(os.path.join(dataset_path, '*' + extension))
+    subtitles_paths = sorted(subtitles_paths, key=get_episode_number)
+    return subtitles_paths
 
-    df = pd.DataFrame.from_dict({"episode":episode_num, "script":scripts })
-    return df
\ No newline at end of file
+
+def ass_time_to_seconds(timestamp):
+    hours, minutes, seconds = timestamp.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def clean_ass_text(text):
+    text = ass_override_pattern.sub('', text)
+    text = text.replace('\\N', ' ').replace('\\n', ' ').replace('\\h', ' ')
+    return text.strip()
+
+
+def parse_ass_lines(lines):
+    records = []
+    in_events = False
+    fields = None
+
+    for line in lines:
+        line = line.strip()
+
+        # Section headers
+        if line.startswith('[') and line.endswith(']'):
+            in_events = line.lower() == '[events]'
+            continue
+        if not in_events or not line:
+            continue
+
+        key, _, value = line.partition(':')
+        key = key.strip().lower()
+        if key == 'format':
+            fields = [field.strip().lower() for field in value.split(',')]
+            continue
+        if key != 'dialogue' or fields is None:
+            continue
+
+        # Text is the last field and may contain commas itself
+        values = value.split(',', len(fields) - 1)
+        if len(values) < len(fields):
+            continue
+        event = dict(zip(fields, values))
+
+        text = clean_ass_text(event['text'])
+        if not text:
+            continue
+
+        records.append({
+            "start": ass_time_to_seconds(event['start']),
+            "end": ass_time_to_seconds(event['end']),
+            "text": text,
+        })
+    return records
+
+
+def parse_srt_lines(lines):
+    records = []
+    block = []
+
+    for line in lines + ['']:
+        line = line.strip()
+        if line:
+            block.append(line)
+            continue
+        if not block:
+            continue
+
+        # A block is: index, timestamps, one or more text lines
+        timestamp_index = next((index for index, block_line in enumerate(block) if '-->' in block_line), None)
+        if timestamp_index is not None:
+            match = srt_timestamp_pattern.search(block[timestamp_index])
+            text = " ".join(block[timestamp_index + 1:])
+            text = srt_tag_pattern.sub('', text).strip()
+            if match and text:
+                h1, m1, s1, ms1, h2, m2, s2, ms2 = [int(group) for group in match.groups()]
+                records.append({
+                    "start": h1 * 3600 + m1 * 60 + s1 + ms1 / 1000,
+                    "end": h2 * 3600 + m2 * 60 + s2 + ms2 / 1000,
+                    "text": text,
+                })
+        block = []
+    return records
+
+
+def parse_subtitle_file(path):
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as file:
+        lines = file.read().splitlines()
+
+    if path.lower().endswith('.srt'):
+        return parse_srt_lines(lines)
+    return parse_ass_lines(lines)
+
+
+def parse_episode(path):
+    subtitle_lines = parse_subtitle_file(path)
+    return {
+        "episode": get_episode_number(path),
+        "path": path,
+        "lines": subtitle_lines,
+    }
+
+
+def iter_parsed_paths(subtitles_paths, parse_function=parse_episode, num_workers=None):
+    if not subtitles_paths:
+        return
+
+    if num_workers == 1 or len(subtitles_paths) == 1:
+        for path in subtitles_paths:
+            yield parse_function(path)
+        return
+
+    # map() yields in submission order as soon as each file is parsed,
+    # so episode 1 is available while later episodes are still being read
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for parsed_episode in executor.map(parse_function, subtitles_paths, chunksize=4):
+            yield parsed_episode
+
+
+def iter_parsed_episodes(dataset_path, num_workers=None):
+    subtitles_paths = list_subtitle_paths(dataset_path)
+    yield from iter_parsed_paths(subtitles_paths, num_workers=num_workers)
+
+
+def iter_subtitles(dataset_path, per_line=False, num_workers=None):
+    for parsed_episode in iter_parsed_episodes(dataset_path, num_workers=num_workers):
+        if per_line:
+            for line in parsed_episode['lines']:
+                yield {"episode": parsed_episode['episode'], **line}
+        else:
+            script = " ".join(line['text'] for line in parsed_episode['lines'])
+            yield {"episode": parsed_episode['episode'], "script": script}
+
+
+def load_subtitles_dataset(dataset_path, per_line=False, num_workers=None):
+    records = list(iter_subtitles(dataset_path, per_line=per_line, num_workers=num_workers))
+    columns = ["episode", "start", "end", "text"] if per_line else ["episode", "script"]
+    df = pd.DataFrame.from_records(records, columns=columns)
+    return df
@@ -0,0 +1,162 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+from .result_store import ResultStore, encode_params
+
+IN_FLIGHT_STATUSES = ("queued", "running", "cancelling")
+
+
+class JobCancelled(RuntimeError):
+    pass
+
+
+def get_job_key(kind, params):
+    return hashlib.sha1(f"{kind}:{encode_params(params)}".encode("utf-8")).hexdigest()
+
+
+def run_job(function, job_id, params, progress_queue, cancelled):
+    # Runs in a worker process; cancellation is checked whenever the job reports progress
+    def progress_callback(stage_name, done_chunks, total_chunks, eta_seconds):
+        if job_id in cancelled:
+            raise JobCancelled(f"Job {job_id} was cancelled")
+        progress_queue.put((job_id, stage_name, done_chunks, total_chunks, eta_seconds))
+
+    return function(params, progress_callback)
+
+
+class Job():
+    def __init__(self, job_id, kind, params, key):
+        self.job_id = job_id
+        self.kind = kind
+        self.params = params
+        self.key = key
+        self.status = "queued"
+        # stage name -> (done chunks, total chunks, ETA seconds)
+        self.progress = {}
+        self.error = None
+        self.cancel_requested = False
+        self.future = None
+        self.submit_time = time.time()
+        self.finish_time = None
+
+
+class JobQueue():
+    # function(params, progress_callback) must be a module-level function returning something JSON-serializable
+    def __init__(self, result_store_path, max_workers=2):
+        self.result_store = ResultStore(result_store_path)
+        self.max_workers = max_workers
+        self.executor = None
+        self.manager = None
+        self.progress_queue = None
+        self.cancelled = None
+        self.jobs = {}
+        self.in_flight = {}
+        # Re-entrant: cancelling a queued future runs finish() right away on the same thread
+        self.lock = threading.RLock()
+
+    def start(self):
+        if self.executor is not None:
+            return
+        # spawn: forking a process that already runs torch threads can deadlock
+        mp_context = multiprocessing.get_context("spawn")
+        self.manager = mp_context.Manager()
+        self.progress_queue = self.manager.Queue()
+        self.cancelled = self.manager.dict()
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp_context)
+
+    def submit(self, kind, function, params):
+        # Identical requests (same kind and params) share the job that is already queued or running
+        key = get_job_key(kind, params)
+        with self.lock:
+            if key in self.in_flight:
+                return self.in_flight[key]
+            self.start()
+            job = Job(uuid.uuid4().hex[:12], kind, params, key)
+            self.jobs[job.job_id] = job
+            self.in_flight[key] = job.job_id
+            self.result_store.put_job(job.job_id, kind, params, job.status)
+            job.future = self.executor.submit(run_job, function, job.job_id, params, self.progress_queue, self.cancelled)
+        job.future.add_done_callback(lambda future: self.finish(job, future))
+        return job.job_id
+
+    def finish(self, job, future):
+        result, error = None, None
+        if future.cancelled():
+            status = "cancelled"
+        elif isinstance(future.exception(), JobCancelled):
+            status = "cancelled"
+        elif future.exception() is not None:
+            status, error = "failed", repr(future.exception())
+        else:
+            status, result = "done", future.result()
+
+        # Results live in the result store, so they outlive the browser tab and the job entry
+        self.result_store.put_job(job.job_id, job.kind, job.params, status, result, error)
+        with self.lock:
+            job.status, job.error, job.finish_time = status, error, time.time()
+            if self.in_flight.get(job.key) == job.job_id:
+                self.in_flight.pop(job.key)
+            if job.cancel_requested:
+                self.cancelled.pop(job.job_id, None)
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status not in IN_FLIGHT_STATUSES:
+                return False
+            if job.future.cancel():
+                return True
+            # Already running: the worker stops at its next progress report, finished chunks stay checkpointed.
+            # A resubmit of the same params from now on starts a new job instead of joining this one
+            self.cancelled[job_id] = True
+            job.cancel_requested = True
+            job.status = "cancelling"
+            if self.in_flight.get(job.key) == job_id:
+                self.in_flight.pop(job.key)
+            return True
+
+    def drain_progress(self):
+        while True:
+            try:
+                job_id, stage_name, done_chunks, total_chunks, eta_seconds = self.progress_queue.get_nowait()
+            except queue.Empty:
+                return
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.progress[stage_name] = (done_chunks, total_chunks, eta_seconds)
+
+    def status(self, job_id):
+        with self.lock:
+            if self.progress_queue is not None:
+                self.drain_progress()
+            job = self.jobs.get(job_id)
+            if job is not None and job.status in IN_FLIGHT_STATUSES:
+                if job.status == "queued" and job.future.running():
+                    job.status = "running"
+                return {"job_id": job_id, "kind": job.kind, "params": job.params, "status": job.status,
+                        "progress": dict(job.progress), "elapsed_seconds": time.time() - job.submit_time,
+                        "result": None, "error": None}
+
+        # Finished jobs, including ones from an earlier run of the app, are read back from the store
+        job = self.result_store.get_job(job_id)
+        if job is None:
+            return None
+        if job["status"] in IN_FLIGHT_STATUSES:
+            # Left unfinished by an app process that has since stopped
+            job["status"] = "interrupted"
+        job["progress"] = {}
+        return job
+
+    def shutdown(self):
+        if self.executor is None:
+            return
+        # Running jobs stop at their next progress report; the manager has to outlive them
+        for job_id in [job.job_id for job in self.jobs.values() if job.status in IN_FLIGHT_STATUSES]:
+            self.cancel(job_id)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.manager.shutdown()
+        self.executor = None
@@ -0,0 +1,17 @@
+import importlib
+import sys
+
+
+def lazy_exports(package_name, exports):
+    # Module-level __getattr__ (PEP 562): a submodule is only imported when one of its names is used
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(exports[name], package_name), name)
+        setattr(sys.modules[package_name], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package_name])) | set(exports))
+
+    return __getattr__, __dir__
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+import gc
+import os
+import threading
+import time
+
+
+def estimate_model_size(model):
+    # Bytes held by torch weights/buffers, or by an ONNX or GGUF file on disk
+    if isinstance(model, (tuple, list)):
+        return sum(estimate_model_size(item) for item in model)
+    if hasattr(model, 'onnx_path'):
+        return os.path.getsize(model.onnx_path)
+    if hasattr(model, 'gguf_path'):
+        return os.path.getsize(model.gguf_path)
+    if hasattr(model, 'model') and not hasattr(model, 'state_dict'):
+        return estimate_model_size(model.model)
+    if hasattr(model, 'state_dict'):
+        # state_dict also covers packed int8 weights, which are not parameters
+        return sum(tensor_size(value) for value in model.state_dict().values())
+    return 0
+
+
+def tensor_size(value):
+    if isinstance(value, (tuple, list)):
+        return sum(tensor_size(item) for item in value)
+    if hasattr(value, 'numel') and hasattr(value, 'element_size'):
+        return value.numel() * value.element_size()
+    return 0
+
+
+class ModelRegistry():
+    def __init__(self, memory_budget_bytes=None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.models = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                self.hits += 1
+                return self.models[key]
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        # One loader per key; concurrent requests for the same model wait for it
+        with key_lock:
+            with self.lock:
+                if key in self.models:
+                    self.models.move_to_end(key)
+                    self.hits += 1
+                    return self.models[key]
+
+            start_time = time.time()
+            model = loader()
+            size = estimate_model_size(model)
+            print(f"Loaded model {key} in {time.time() - start_time:.1f}s ({size / 1e6:.0f} MB)")
+
+            with self.lock:
+                self.misses += 1
+                self.models[key] = model
+                self.sizes[key] = size
+                self.evict(keep=key)
+            return model
+
+    def evict(self, keep=None):
+        if self.memory_budget_bytes is None:
+            return
+        # Least recently used first, never the model that was just requested
+        evicted = False
+        while sum(self.sizes.values()) > self.memory_budget_bytes:
+            candidates = [key for key in self.models if key != keep]
+            if not candidates:
+                break
+            key = candidates[0]
+            print(f"Evicting model {key} to stay within the memory budget")
+            del self.models[key]
+            del self.sizes[key]
+            evicted = True
+
+        if evicted:
+            gc.collect()
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+    def warm_up(self, loaders):
+        for key, loader in loaders:
+            self.get(key, loader)
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+            self.sizes.clear()
+        gc.collect()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "models": list(self.models),
+                "memory_bytes": sum(self.sizes.values()),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def get_memory_budget_from_env():
+    memory_budget_gb = os.getenv("model_memory_budget_gb")
+    return int(float(memory_budget_gb) * 1e9) if memory_budget_gb else None
+
+
+model_registry = ModelRegistry(memory_budget_bytes=get_memory_budget_from_env())
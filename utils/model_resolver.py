@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+
+DEFAULT_LOCAL_MODEL_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nlp_series_analysis", "models")
+MANIFEST_FILE_NAME = "manifest.json"
+MODEL_FILE_NAMES = ["config.json", "adapter_config.json"]
+
+
+class HubUnavailableError(RuntimeError):
+    pass
+
+
+def is_offline():
+    return any(os.getenv(name, "0").lower() in ("1", "true", "yes") for name in ("HF_HUB_OFFLINE", "TRANSFORMERS_OFFLINE", "model_resolver_offline"))
+
+
+def get_local_model_dir():
+    return os.getenv("local_model_dir", DEFAULT_LOCAL_MODEL_DIR)
+
+
+def is_model_folder(path):
+    return os.path.isdir(path) and any(os.path.exists(os.path.join(path, file_name)) for file_name in MODEL_FILE_NAMES)
+
+
+def read_manifest(local_model_dir=None):
+    # {"Koutilya/Naruto-Chatbot-Llama-3.2-3B-Instruct": "naruto-chatbot", ...}, paths relative to the manifest
+    local_model_dir = local_model_dir or get_local_model_dir()
+    manifest_path = os.path.join(local_model_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    return {model_id: os.path.join(local_model_dir, path) for model_id, path in manifest.items()}
+
+
+def find_in_hub_cache(model_path):
+    from huggingface_hub import try_to_load_from_cache
+
+    for file_name in MODEL_FILE_NAMES:
+        cached_path = try_to_load_from_cache(model_path, file_name)
+        if isinstance(cached_path, str):
+            return True
+    return False
+
+
+hub_repo_cache = {}
+
+
+def repo_exists_on_hub(model_path):
+    # Only answers from the Hub are memoized; local folders can appear at any time (e.g. after training).
+    # A failed check is not an answer: it raises instead of passing for "missing", which would start training
+    if model_path in hub_repo_cache:
+        return hub_repo_cache[model_path]
+    import huggingface_hub
+
+    try:
+        exists = huggingface_hub.repo_exists(model_path)
+    except Exception as error:
+        raise HubUnavailableError(f"Could not reach the Hugging Face Hub to check {model_path}: {error}") from error
+    hub_repo_cache[model_path] = exists
+    return exists
+
+
+def resolve_model(model_path, local_model_dir=None):
+    # Returns what from_pretrained should load (a local folder or the Hub id), or None if the model is unavailable
+    if is_model_folder(model_path):
+        return model_path
+
+    manifest_path = read_manifest(local_model_dir).get(model_path)
+    if manifest_path and is_model_folder(manifest_path):
+        return manifest_path
+
+    local_path = os.path.join(local_model_dir or get_local_model_dir(), model_path.strip("/").replace("/", "--"))
+    if is_model_folder(local_path):
+        return local_path
+
+    if find_in_hub_cache(model_path):
+        return model_path
+    if is_offline():
+        return None
+    return model_path if repo_exists_on_hub(model_path) else None
+
+
+def forget_model(model_path):
+    # After pushing a freshly trained model the memoized "does not exist" answer is stale
+    hub_repo_cache.pop(model_path, None)
+
+
+logged_in_tokens = set()
+
+
+def login_once(huggingface_token):
+    if huggingface_token is None or is_offline():
+        return
+    token_hash = hashlib.sha1(huggingface_token.encode("utf-8")).hexdigest()
+    if token_hash in logged_in_tokens:
+        return
+    import huggingface_hub
+
+    huggingface_hub.login(huggingface_token)
+    logged_in_tokens.add(token_hash)
@@ -0,0 +1,33 @@
+import os
+
+checked_resources = set()
+
+
+def get_punkt_resource():
+    # NLTK >= 3.8.2 reads the pickle-free punkt_tab data, older versions read punkt
+    from nltk.tokenize import punkt
+    return "punkt_tab" if hasattr(punkt, "PunktTokenizer") else "punkt"
+
+
+def ensure_nltk_data(resource=None):
+    # Look for the data locally first; only download what is missing, and never when offline
+    import nltk
+
+    resource = resource or get_punkt_resource()
+    if resource in checked_resources:
+        return
+
+    try:
+        nltk.data.find(f"tokenizers/{resource}")
+    except LookupError:
+        offline = os.getenv("HF_HUB_OFFLINE") == "1" or os.getenv("NLTK_OFFLINE") == "1"
+        if offline or not nltk.download(resource, quiet=True):
+            raise LookupError(f"NLTK resource '{resource}' is not installed. "
+                              f"Install it with: python -m nltk.downloader {resource}")
+    checked_resources.add(resource)
+
+
+def sent_tokenize(text):
+    ensure_nltk_data()
+    from nltk.tokenize import sent_tokenize as nltk_sent_tokenize
+    return nltk_sent_tokenize(text)
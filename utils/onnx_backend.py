@@ -0,0 +1,203 @@
+import hashlib
+import inspect
+import json
+import os
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
+
+DEFAULT_ONNX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nlp_series_analysis", "onnx")
+CONFIG_FILE_NAMES = ["config.json", "adapter_config.json"]
+WEIGHT_FILE_SUFFIXES = (".safetensors", ".bin", ".pt")
+
+parity_texts = [
+    "Naruto wants to become Hokage so the whole village will finally acknowledge him.",
+    "Sasuke leaves the village to train with Orochimaru.",
+    "Kakashi tells his team that those who abandon their friends are worse than scum.",
+    "The Nine-Tailed Fox was sealed inside Naruto by the Fourth Hokage.",
+    "Rasengan: the user gathers chakra into a spinning sphere in the palm of the hand.",
+    "Shadow Clone Technique creates solid copies of the user.",
+]
+parity_pairs = [
+    "This example is friendship.",
+    "This example is betrayal.",
+    "This example is battle.",
+    "This example is sacrifice.",
+    "This example is self development.",
+    "This example is love.",
+]
+
+
+class OnnxSequenceClassifier():
+    def __init__(self, onnx_path, config, num_threads=None):
+        import onnxruntime as ort
+
+        self.onnx_path = onnx_path
+        self.config = config
+        self.device = torch.device("cpu")
+
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = num_threads or os.cpu_count()
+        session_options.inter_op_num_threads = 1
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, session_options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def predict_logits(self, input_ids, attention_mask):
+        inputs = {"input_ids": np.asarray(input_ids, dtype=np.int64), "attention_mask": np.asarray(attention_mask, dtype=np.int64)}
+        inputs = {name: value for name, value in inputs.items() if name in self.input_names}
+        return self.session.run(["logits"], inputs)[0]
+
+
+class OnnxTextClassifier():
+    # Drop-in for the text-classification pipeline with top_k=None
+    def __init__(self, model, tokenizer, batch_size=32, max_length=512):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def __call__(self, texts, batch_size=None):
+        if isinstance(texts, str):
+            texts = [texts]
+        batch_size = batch_size or self.batch_size
+        id2label = self.model.config.id2label
+
+        output = []
+        for start in range(0, len(texts), batch_size):
+            batch = self.tokenizer(list(texts[start:start + batch_size]), padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+            logits = self.model.predict_logits(batch["input_ids"], batch["attention_mask"])
+            logits = logits - logits.max(axis=1, keepdims=True)
+            probabilities = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+            for row in probabilities:
+                scores = [{"label": id2label[index], "score": float(score)} for index, score in enumerate(row)]
+                output.append(sorted(scores, key=lambda x: x["score"], reverse=True))
+        return output
+
+
+def get_model_fingerprint(model_name_or_path):
+    # Changes when the weights behind a path change: retraining into the same folder, or a new Hub revision
+    if os.path.isdir(model_name_or_path):
+        fingerprint = hashlib.sha1()
+        for file_name in sorted(os.listdir(model_name_or_path)):
+            path = os.path.join(model_name_or_path, file_name)
+            if file_name in CONFIG_FILE_NAMES:
+                with open(path, "rb") as file:
+                    fingerprint.update(file.read())
+            elif file_name.endswith(WEIGHT_FILE_SUFFIXES):
+                stat = os.stat(path)
+                fingerprint.update(f"{file_name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+        return fingerprint.hexdigest()[:12]
+
+    # Hub models: the commit sha of the snapshot from_pretrained loads, i.e. the snapshot folder name
+    from huggingface_hub import try_to_load_from_cache, hf_hub_download
+
+    for file_name in CONFIG_FILE_NAMES:
+        config_path = try_to_load_from_cache(model_name_or_path, file_name)
+        if not isinstance(config_path, str):
+            try:
+                config_path = hf_hub_download(model_name_or_path, file_name)
+            except Exception:
+                continue
+        return os.path.basename(os.path.dirname(config_path))[:12]
+    return None
+
+
+def get_cache_dir(model_name_or_path, cache_dir=None, fingerprint=None):
+    cache_dir = cache_dir or DEFAULT_ONNX_CACHE_DIR
+    model_key = hashlib.sha1(model_name_or_path.encode("utf-8")).hexdigest()[:16]
+    if fingerprint is not None:
+        model_key = f"{model_key}-{fingerprint}"
+    model_slug = model_name_or_path.strip("/").replace("/", "--")[-64:]
+    return os.path.join(cache_dir, f"{model_slug}-{model_key}")
+
+
+def export_onnx_model(model, tokenizer, onnx_path, text_pair=False):
+    sample_pairs = parity_pairs[:2] if text_pair else None
+    sample = tokenizer(parity_texts[:2], sample_pairs, padding=True, return_tensors="pt")
+    export_kwargs = {}
+    # Newer torch versions default to the dynamo exporter
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs["dynamo"] = False
+
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            onnx_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=17,
+            **export_kwargs,
+        )
+
+
+def quantize_onnx_model(onnx_path, quantized_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+
+
+def check_parity(torch_model, onnx_model, tokenizer, texts=None, text_pairs=None):
+    texts = texts or parity_texts
+    batch = tokenizer(texts, text_pairs, padding=True, truncation=True, return_tensors="pt")
+    with torch.no_grad():
+        torch_logits = torch_model(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"]).logits.float().numpy()
+    onnx_logits = onnx_model.predict_logits(batch["input_ids"].numpy(), batch["attention_mask"].numpy())
+
+    def softmax(logits):
+        logits = logits - logits.max(axis=1, keepdims=True)
+        return np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+
+    return {
+        "num_examples": len(texts),
+        "max_abs_logit_diff": float(np.abs(torch_logits - onnx_logits).max()),
+        "max_abs_prob_diff": float(np.abs(softmax(torch_logits) - softmax(onnx_logits)).max()),
+        "argmax_agreement": float((torch_logits.argmax(axis=1) == onnx_logits.argmax(axis=1)).mean()),
+    }
+
+
+def load_onnx_model(model_name_or_path, cache_dir=None, quantize=True, num_threads=None, text_pair=False, min_agreement=0.8):
+    model_cache_dir = get_cache_dir(model_name_or_path, cache_dir, fingerprint=get_model_fingerprint(model_name_or_path))
+    onnx_path = os.path.join(model_cache_dir, "model.onnx")
+    quantized_path = os.path.join(model_cache_dir, "model.int8.onnx")
+    model_path = quantized_path if quantize else onnx_path
+
+    if not os.path.exists(model_path):
+        print(f"Exporting {model_name_or_path} to ONNX in {model_cache_dir}")
+        os.makedirs(model_cache_dir, exist_ok=True)
+        torch_model = AutoModelForSequenceClassification.from_pretrained(model_name_or_path)
+        tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+
+        if not os.path.exists(onnx_path):
+            export_onnx_model(torch_model, tokenizer, onnx_path + ".tmp", text_pair=text_pair)
+            os.replace(onnx_path + ".tmp", onnx_path)
+        if quantize:
+            quantize_onnx_model(onnx_path, quantized_path + ".tmp")
+            os.replace(quantized_path + ".tmp", quantized_path)
+
+        torch_model.config.save_pretrained(model_cache_dir)
+        tokenizer.save_pretrained(model_cache_dir)
+
+        # Accuracy parity against the PyTorch model, kept next to the artifact
+        onnx_model = OnnxSequenceClassifier(model_path, torch_model.config, num_threads=num_threads)
+        parity = check_parity(torch_model, onnx_model, tokenizer, text_pairs=parity_pairs if text_pair else None)
+        with open(os.path.join(model_cache_dir, "parity.json" if quantize else "parity_fp32.json"), "w") as file:
+            json.dump(parity, file, indent=2)
+        print(f"ONNX parity check: {parity}")
+        if parity["argmax_agreement"] < min_agreement:
+            print(f"Warning: ONNX model agrees with PyTorch on only {parity['argmax_agreement']:.0%} of parity examples")
+
+        del torch_model
+        return onnx_model, tokenizer
+
+    config = AutoConfig.from_pretrained(model_cache_dir)
+    tokenizer = AutoTokenizer.from_pretrained(model_cache_dir)
+    onnx_model = OnnxSequenceClassifier(model_path, config, num_threads=num_threads)
+    return onnx_model, tokenizer
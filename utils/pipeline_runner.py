@@ -0,0 +1,110 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+
+DEFAULT_CHECKPOINT_DIR = "pipeline_checkpoints"
+
+
+class PipelineStage():
+    # run_chunk(chunk_df) returns one JSON-serializable result per episode row
+    def __init__(self, name, run_chunk, params=None):
+        self.name = name
+        self.run_chunk = run_chunk
+        self.params = params or {}
+
+    def get_key(self):
+        payload = json.dumps({"name": self.name, "params": self.params}, sort_keys=True, default=str)
+        return f"{self.name}-{hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]}"
+
+
+class PipelineRunner():
+    def __init__(self, checkpoint_dir=DEFAULT_CHECKPOINT_DIR, chunk_size=20):
+        self.checkpoint_dir = checkpoint_dir
+        self.chunk_size = chunk_size
+
+    def get_chunks(self, df):
+        return [df.iloc[start:start + self.chunk_size] for start in range(0, len(df), self.chunk_size)]
+
+    def get_checkpoint_path(self, stage, chunk_index):
+        return os.path.join(self.checkpoint_dir, stage.get_key(), f"chunk-{chunk_index:05d}.json")
+
+    def read_checkpoint(self, stage, chunk_index, file_hashes):
+        # A checkpoint only counts if it was made from exactly these episode files
+        checkpoint_path = self.get_checkpoint_path(stage, chunk_index)
+        if not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path, "r", encoding="utf-8") as file:
+            checkpoint = json.load(file)
+        return checkpoint["results"] if checkpoint["file_hashes"] == file_hashes else None
+
+    def write_checkpoint(self, stage, chunk_index, file_hashes, results):
+        checkpoint_path = self.get_checkpoint_path(stage, chunk_index)
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+        # A temp file per writer: two runs of the same stage (e.g. a job and a direct run) may write the same chunk
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(checkpoint_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump({"file_hashes": file_hashes, "results": results}, file, default=float)
+            os.replace(tmp_path, checkpoint_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def run_stage(self, stage, chunks, progress_queue, stop_event=None):
+        results = []
+        start_time = time.time()
+        computed = 0
+        for chunk_index, chunk in enumerate(chunks):
+            if stop_event is not None and stop_event.is_set():
+                break
+            file_hashes = chunk['file_hash'].tolist()
+            chunk_results = self.read_checkpoint(stage, chunk_index, file_hashes)
+            if chunk_results is None:
+                chunk_results = list(stage.run_chunk(chunk))
+                # Round-trip through JSON so resumed and fresh runs return the same types
+                self.write_checkpoint(stage, chunk_index, file_hashes, chunk_results)
+                chunk_results = self.read_checkpoint(stage, chunk_index, file_hashes)
+                computed += 1
+            results.extend(chunk_results)
+
+            # ETA from the chunks computed in this run; resumed chunks are nearly free
+            remaining = len(chunks) - chunk_index - 1
+            eta_seconds = (time.time() - start_time) / computed * remaining if computed else None
+            progress_queue.put((stage.name, chunk_index + 1, len(chunks), eta_seconds))
+        return results
+
+    def run(self, df, stages, progress_callback=None, poll_seconds=0.5):
+        # Stages share the parsed episodes and run concurrently; progress_callback runs in the calling thread
+        chunks = self.get_chunks(df)
+        progress_queue = queue.Queue()
+        stop_event = threading.Event()
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            futures = {executor.submit(self.run_stage, stage, chunks, progress_queue, stop_event): stage.name for stage in stages}
+            pending = set(futures)
+            try:
+                while pending:
+                    done, pending = wait(pending, timeout=poll_seconds, return_when=FIRST_EXCEPTION)
+                    self.report_progress(progress_queue, progress_callback)
+                    for future in done:
+                        if future.exception() is not None:
+                            raise future.exception()
+                self.report_progress(progress_queue, progress_callback)
+            except BaseException:
+                # A failed stage (or a callback cancelling the run) stops the others after their current chunk;
+                # everything finished so far stays checkpointed
+                stop_event.set()
+                raise
+            return {stage_name: future.result() for future, stage_name in futures.items()}
+
+    def report_progress(self, progress_queue, progress_callback):
+        while not progress_queue.empty():
+            stage_name, done_chunks, total_chunks, eta_seconds = progress_queue.get()
+            eta = f", ETA {eta_seconds:.0f}s" if eta_seconds is not None else ""
+            print(f"{stage_name}: {done_chunks}/{total_chunks} chunks{eta}")
+            if progress_callback is not None:
+                progress_callback(stage_name, done_chunks, total_chunks, eta_seconds)
@@ -0,0 +1,105 @@
+import json
+import os
+import sqlite3
+import time
+
+
+def encode_params(params):
+    return json.dumps(params or {}, sort_keys=True)
+
+
+class ResultStore():
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.create_tables()
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def create_tables(self):
+        with self.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS episode_results (
+                    stage TEXT, model_name TEXT, params TEXT, episode_hash TEXT, value TEXT,
+                    PRIMARY KEY (stage, model_name, params, episode_hash)
+                )""")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS chunk_scores (
+                    model_name TEXT, params TEXT, episode_hash TEXT, chunk_index INTEGER, label TEXT, score REAL,
+                    PRIMARY KEY (model_name, params, episode_hash, chunk_index, label)
+                )""")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, result TEXT, error TEXT, updated_at REAL
+                )""")
+
+    def select_in(self, query, fixed_args, keys, batch_size=500):
+        # SQLite limits the number of bound variables per statement
+        keys = list(keys)
+        rows = []
+        with self.connect() as connection:
+            for index in range(0, len(keys), batch_size):
+                batch = keys[index:index + batch_size]
+                placeholders = ",".join("?" * len(batch))
+                rows += connection.execute(query.format(placeholders=placeholders), [*fixed_args, *batch]).fetchall()
+        return rows
+
+    def get_episode_results(self, stage, model_name, params, episode_hashes):
+        rows = self.select_in(
+            "SELECT episode_hash, value FROM episode_results "
+            "WHERE stage=? AND model_name=? AND params=? AND episode_hash IN ({placeholders})",
+            [stage, model_name, encode_params(params)],
+            episode_hashes,
+        )
+        return {episode_hash: json.loads(value) for episode_hash, value in rows}
+
+    def put_episode_results(self, stage, model_name, params, results):
+        params = encode_params(params)
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO episode_results VALUES (?, ?, ?, ?, ?)",
+                [(stage, model_name, params, episode_hash, json.dumps(value)) for episode_hash, value in results.items()],
+            )
+
+    def get_chunk_scores(self, model_name, params, episode_hashes, labels=None):
+        rows = self.select_in(
+            "SELECT episode_hash, chunk_index, label, score FROM chunk_scores "
+            "WHERE model_name=? AND params=? AND episode_hash IN ({placeholders})",
+            [model_name, encode_params(params)],
+            episode_hashes,
+        )
+        if labels is not None:
+            labels = set(labels)
+            rows = [row for row in rows if row[2] in labels]
+        return {(episode_hash, chunk_index, label): score for episode_hash, chunk_index, label, score in rows}
+
+    def put_chunk_scores(self, model_name, params, scores):
+        params = encode_params(params)
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO chunk_scores VALUES (?, ?, ?, ?, ?, ?)",
+                [(model_name, params, episode_hash, chunk_index, label, float(score))
+                 for (episode_hash, chunk_index, label), score in scores.items()],
+            )
+
+    def put_job(self, job_id, kind, params, status, result=None, error=None):
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, encode_params(params), status, json.dumps(result), error, time.time()),
+            )
+
+    def get_job(self, job_id):
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT kind, params, status, result, error FROM jobs WHERE job_id=?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        kind, params, status, result, error = row
+        return {"job_id": job_id, "kind": kind, "params": json.loads(params), "status": status,
+                "result": json.loads(result) if result is not None else None, "error": error}
@@ -0,0 +1,48 @@
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer
+from .model_registry import model_registry
+
+
+class SentenceEncoder():
+    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2", device=None, batch_size=32, max_length=256):
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer, self.model = self.load_model()
+
+    def load_model(self):
+        def load():
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModel.from_pretrained(self.model_name).to(self.device)
+            model.eval()
+            return tokenizer, model
+        return model_registry.get(("sentence-encoder", self.model_name, "torch", self.device), load)
+
+    def mean_pooling(self, token_embeddings, attention_mask):
+        mask = attention_mask.unsqueeze(-1).to(token_embeddings.dtype)
+        return (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+    def encode(self, texts):
+        if len(texts) == 0:
+            return np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+
+        # Length-sorted batches keep padding low
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.zeros((len(texts), self.model.config.hidden_size), dtype=np.float32)
+
+        for start in range(0, len(order), self.batch_size):
+            batch_index = order[start:start + self.batch_size]
+            batch = self.tokenizer([texts[index] for index in batch_index],
+                                   padding=True,
+                                   truncation=True,
+                                   max_length=self.max_length,
+                                   return_tensors="pt").to(self.device)
+            with torch.no_grad():
+                output = self.model(**batch)
+            pooled = self.mean_pooling(output[0], batch['attention_mask'])
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+            embeddings[batch_index] = pooled.float().cpu().numpy()
+
+        return embeddings